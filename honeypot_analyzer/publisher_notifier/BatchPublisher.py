@@ -0,0 +1,145 @@
+"""Buffers threat notifications and publishes them in batches.
+
+Notifications are queued by publish() and sent by a background thread as one
+message holding a list of notifications, once max_batch_size are queued or
+the oldest one waited max_delay seconds. Failed sends are retried with
+exponential backoff.
+"""
+
+import Queue
+import threading
+import time
+
+from absl import logging
+
+STAGE_PUBLISH = 'publish'
+
+_SEND_TIMEOUT = 10
+
+
+class BatchPublisher(object):
+    """Batched publishing over a Transport."""
+
+    def __init__(self, transport, channel, max_batch_size=50, max_delay=1.0, max_retries=5, retry_delay=0.5,
+                 max_queue=10000, counters=None):
+        """
+
+        :param transport: A Transport.Transport.
+        :param channel: (str) Channel to publish to.
+        :param max_batch_size: (int) Maximum notifications per message.
+        :param max_delay: (float) Seconds a notification waits for its batch to fill.
+        :param max_retries: (int) Retries of a failed batch before it is dropped.
+        :param retry_delay: (float) Seconds before first retry, doubled on each retry.
+        :param max_queue: (int) Maximum notifications waiting, newer ones are dropped.
+        :param counters: Object with record(stage, seconds), e.g. pipeline.LatencyCounters.
+        """
+        if not channel:
+            raise ValueError('Invalid channel')
+        self._transport = transport
+        self._channel = channel
+        self._max_batch_size = max_batch_size
+        self._max_delay = max_delay
+        self._max_retries = max_retries
+        self._retry_delay = retry_delay
+        self._queue = Queue.Queue(max_queue)
+        self._counters = counters
+        self._stop = threading.Event()
+        self._thread = None
+        self.sent = 0
+        self.batches = 0
+        self.retries = 0
+        self.failed = 0
+        self.dropped = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='batch-publisher')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        """Flushes queued notifications and stops."""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+        self._transport.close()
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def publish(self, message):
+        """Queues a notification. Never blocks."""
+        if not message:
+            raise ValueError('Invalid message')
+        try:
+            self._queue.put_nowait(message)
+        except Queue.Full:
+            self.dropped += 1
+            logging.error('Publish queue is full. Dropping message: %s' % message)
+
+    def stats(self):
+        return {'queue_depth': self.queue_depth(),
+                'sent': self.sent,
+                'batches': self.batches,
+                'retries': self.retries,
+                'failed': self.failed,
+                'dropped': self.dropped}
+
+    def _next_batch(self):
+        try:
+            batch = [self._queue.get(timeout=self._max_delay)]
+        except Queue.Empty:
+            return []
+        deadline = time.time() + self._max_delay
+        while len(batch) < self._max_batch_size:
+            remaining = deadline - time.time()
+            if remaining <= 0 or self._stop.is_set():
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except Queue.Empty:
+                break
+        return batch
+
+    def _send(self, batch):
+        """Sends batch and waits for transport callback. Returns error or None."""
+        done = threading.Event()
+        result = []
+
+        def callback(error):
+            result.append(error)
+            done.set()
+
+        try:
+            self._transport.send(self._channel, batch, callback)
+        except Exception as e:
+            return e
+        if not done.wait(_SEND_TIMEOUT):
+            return 'Timeout'
+        return result[0]
+
+    def _publish_batch(self, batch):
+        delay = self._retry_delay
+        for attempt in range(self._max_retries + 1):
+            start = time.time()
+            error = self._send(batch)
+            if self._counters:
+                self._counters.record(STAGE_PUBLISH, time.time() - start)
+            if not error:
+                self.sent += len(batch)
+                self.batches += 1
+                logging.info('Published %d messages to %s' % (len(batch), self._channel))
+                return
+            if attempt == self._max_retries:
+                break
+            logging.warning('Publish failed: %s. Retrying in %.2f seconds' % (error, delay))
+            self.retries += 1
+            time.sleep(delay)
+            delay *= 2
+        self.failed += len(batch)
+        logging.error('Message failed to be published. Dropping %d messages' % len(batch))
+
+    def _run(self):
+        while not (self._stop.is_set() and self._queue.empty()):
+            batch = self._next_batch()
+            if batch:
+                self._publish_batch(batch)
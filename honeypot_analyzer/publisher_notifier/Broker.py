@@ -0,0 +1,327 @@
+"""Local pub/sub fan-out broker. Alternative to PubNub without third parties.
+
+Clients exchange newline delimited JSON frames over TCP ('host:port') or a
+UNIX socket ('unix:/path'):
+
+    {"op": "subscribe", "channel": "honeypot"}
+    {"op": "publish", "channel": "honeypot", "message": ...}
+
+Every publish is acknowledged with {"op": "ack"} and delivered to all
+subscribers of the channel as {"channel": "honeypot", "message": ...}.
+The broker is a single threaded select() loop; a subscriber which does not
+keep up with max_buffer bytes of pending data is disconnected.
+
+    python -m honeypot_analyzer.publisher_notifier.Broker --broker_address=0.0.0.0:7070
+"""
+
+import errno
+import json
+import os
+import select
+import socket
+import threading
+import time
+
+from absl import app
+from absl import flags
+from absl import logging
+
+from honeypot_analyzer.publisher_notifier import Transport
+
+DEFAULT_ADDRESS = '127.0.0.1:7070'
+
+_ACK = json.dumps({'op': 'ack'}) + '\n'
+_READ_SIZE = 65536
+_SELECT_TIMEOUT = 0.5
+_CONNECT_TIMEOUT = 5
+_RECONNECT_DELAY = 1
+
+FLAGS = flags.FLAGS
+
+
+def _socket_address(address):
+    """Returns (family, address) for 'unix:/path' or 'host:port'."""
+    if address.startswith('unix:'):
+        return socket.AF_UNIX, address[len('unix:'):]
+    host, _, port = address.rpartition(':')
+    if not host or not port:
+        raise ValueError('Invalid broker address: %s' % address)
+    return socket.AF_INET, (host, int(port))
+
+
+def connect(address, timeout=_CONNECT_TIMEOUT):
+    family, socket_address = _socket_address(address)
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    sock.connect(socket_address)
+    if family == socket.AF_INET:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
+
+
+class _Client(object):
+    def __init__(self, sock):
+        self.sock = sock
+        self.inbound = ''
+        self.outbound = ''
+        self.channels = set()
+
+
+class BrokerServer(object):
+    """Fans out published messages to channel subscribers."""
+
+    def __init__(self, address=DEFAULT_ADDRESS, max_buffer=4 * 1024 * 1024):
+        """
+
+        :param address: (str) 'host:port' or 'unix:/path' to listen on.
+        :param max_buffer: (int) Bytes pending for a client before it is disconnected.
+        """
+        self._address = address
+        self._max_buffer = max_buffer
+        self._clients = {}
+        self._stop = threading.Event()
+        family, socket_address = _socket_address(address)
+        if family == socket.AF_UNIX and os.path.exists(socket_address):
+            os.unlink(socket_address)
+        self._server = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_INET:
+            self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind(socket_address)
+        self._server.listen(128)
+        self._server.setblocking(False)
+        self.published = 0
+        self.delivered = 0
+
+    @property
+    def address(self):
+        """Bound address, useful when listening on port 0."""
+        if isinstance(self._server.getsockname(), tuple):
+            return '%s:%d' % self._server.getsockname()
+        return 'unix:%s' % self._server.getsockname()
+
+    def stop(self):
+        self._stop.set()
+
+    def serve_forever(self):
+        logging.info('Broker listening on %s' % self.address)
+        try:
+            while not self._stop.is_set():
+                writers = [sock for sock, client in self._clients.iteritems() if client.outbound]
+                readable, writable, _ = select.select([self._server] + self._clients.keys(), writers, [],
+                                                      _SELECT_TIMEOUT)
+                for sock in readable:
+                    if sock is self._server:
+                        self._accept()
+                    # Handling a publish may have disconnected other clients.
+                    elif sock in self._clients:
+                        self._serve(self._read, sock)
+                for sock in writable:
+                    if sock in self._clients:
+                        self._serve(self._write, sock)
+        finally:
+            for sock in self._clients.keys():
+                self._close(sock)
+            self._server.close()
+
+    def _serve(self, method, sock):
+        """Runs method for a client, disconnecting it on error instead of stopping the broker."""
+        try:
+            method(sock)
+        except Exception as e:
+            logging.exception('Client error: %s' % e)
+            self._close(sock)
+
+    def _accept(self):
+        try:
+            sock, _ = self._server.accept()
+        except socket.error:
+            return
+        sock.setblocking(False)
+        self._clients[sock] = _Client(sock)
+
+    def _close(self, sock):
+        self._clients.pop(sock, None)
+        try:
+            sock.close()
+        except socket.error:
+            pass
+
+    def _read(self, sock):
+        client = self._clients.get(sock)
+        if not client:
+            return
+        try:
+            data = sock.recv(_READ_SIZE)
+        except socket.error as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            data = ''
+        if not data:
+            self._close(sock)
+            return
+        client.inbound += data
+        # Stop if the client was disconnected, e.g. slow to read its acks.
+        while '\n' in client.inbound and sock in self._clients:
+            line, client.inbound = client.inbound.split('\n', 1)
+            if line:
+                self._handle(client, line)
+
+    def _handle(self, client, line):
+        try:
+            frame = json.loads(line)
+            op = frame['op']
+            channel = frame['channel']
+        except (ValueError, KeyError, TypeError):
+            logging.error('Invalid frame: %r' % line[:200])
+            return
+        if op == 'subscribe':
+            client.channels.add(channel)
+        elif op == 'unsubscribe':
+            client.channels.discard(channel)
+        elif op == 'publish':
+            self.published += 1
+            # Serialize once for all subscribers.
+            delivery = json.dumps({'channel': channel, 'message': frame.get('message')}) + '\n'
+            for subscriber in self._clients.values():
+                if channel in subscriber.channels:
+                    self._queue(subscriber, delivery)
+                    self.delivered += 1
+            self._queue(client, _ACK)
+
+    def _queue(self, client, data):
+        if len(client.outbound) + len(data) > self._max_buffer:
+            logging.warning('Disconnecting slow client')
+            self._close(client.sock)
+            return
+        client.outbound += data
+        # Try right away, most of the time the socket is writable.
+        self._write(client.sock)
+
+    def _write(self, sock):
+        client = self._clients.get(sock)
+        if not client:
+            return
+        try:
+            sent = sock.send(client.outbound)
+        except socket.error as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            self._close(sock)
+            return
+        client.outbound = client.outbound[sent:]
+
+
+class BrokerTransport(Transport.Transport):
+    """Publishes to a BrokerServer. Waits for the broker ack of every message."""
+
+    def __init__(self, address=DEFAULT_ADDRESS):
+        self._address = address
+        self._sock = None
+        self._reader = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        self._sock = connect(self._address)
+        self._reader = self._sock.makefile('rb')
+
+    def send(self, channel, message, callback):
+        frame = json.dumps({'op': 'publish', 'channel': channel, 'message': message}) + '\n'
+        with self._lock:
+            try:
+                if not self._sock:
+                    self._connect()
+                self._sock.sendall(frame)
+                if not self._reader.readline():
+                    raise Transport.TransportError('Broker closed connection')
+                error = None
+            except (socket.error, Transport.TransportError) as e:
+                self.close()
+                error = e
+        callback(error)
+
+    def close(self):
+        if self._sock:
+            try:
+                self._sock.close()
+            except socket.error:
+                pass
+        self._sock = None
+        self._reader = None
+
+
+class BrokerSubscriber(object):
+    """Receives messages of a channel from a BrokerServer. Reconnects on failure."""
+
+    def __init__(self, address, channel, listener):
+        """
+
+        :param address: (str) Broker address.
+        :param channel: (str) Channel to subscribe to.
+        :param listener: Callable invoked with (channel, message).
+        """
+        self._address = address
+        self._channel = channel
+        self._listener = listener
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name='broker-subscriber')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self):
+        while not self._stop.is_set():
+            sock = None
+            try:
+                sock = connect(self._address)
+                # Finite timeout, so stop is noticed while no message arrives.
+                sock.settimeout(_SELECT_TIMEOUT)
+                sock.sendall(json.dumps({'op': 'subscribe', 'channel': self._channel}) + '\n')
+                logging.info('Subscribed to %s on %s' % (self._channel, self._address))
+                inbound = ''
+                while not self._stop.is_set():
+                    try:
+                        data = sock.recv(_READ_SIZE)
+                    except socket.timeout:
+                        continue
+                    if not data:
+                        logging.error('Broker closed connection')
+                        break
+                    inbound += data
+                    while '\n' in inbound:
+                        line, inbound = inbound.split('\n', 1)
+                        if line:
+                            self._deliver(line)
+            except socket.error as e:
+                logging.error('Broker connection error: %s' % e)
+            finally:
+                if sock:
+                    sock.close()
+            if not self._stop.is_set():
+                time.sleep(_RECONNECT_DELAY)
+
+    def _deliver(self, line):
+        try:
+            frame = json.loads(line)
+            channel = frame['channel']
+            message = frame['message']
+        except (ValueError, KeyError, TypeError):
+            logging.error('Invalid frame: %r' % line[:200])
+            return
+        try:
+            self._listener(channel, message)
+        except Exception as e:
+            logging.exception(e)
+
+
+def main(_):
+    BrokerServer(FLAGS.broker_address).serve_forever()
+
+
+if __name__ == '__main__':
+    flags.DEFINE_string('broker_address', DEFAULT_ADDRESS, "Address to listen on, 'host:port' or 'unix:/path'")
+    app.run(main)
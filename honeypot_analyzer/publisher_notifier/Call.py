@@ -1,24 +1,23 @@
 """Gets call information from Database."""
 
+import collections
 import datetime
+import threading
+import time
+
 import pytz
 
+from absl import logging
 
-class Call(object):
-    def __init__(self, call_id, source_ip, source_port):
-        self.call_id = call_id
-        self.source_ip = source_ip
-        self.source_port = source_port
+from utils import lru_cache
 
-    def GetCallInfo(self, db_client):
-        """
+_TABLE_PREFIX = 'sip_capture_call_'
+_TABLES_QUERY = "SHOW TABLES FROM homer_data LIKE 'sip_capture_call\\_%'"
+# Do not refresh table list more often when looking for a new day table.
+_MIN_REFRESH_INTERVAL = 10
 
-        :param db_client:
-        :return:
-        """
-        # Make it UTC aware
-        today = datetime.datetime.now(pytz.UTC).strftime('%Y%m%d')
-        query = """
+# Homer creates one table per day, table name can not be a query parameter.
+_SELECT_INVITES = """
         SELECT
             ruri,
             ruri_user,
@@ -39,10 +38,203 @@ class Call(object):
         FROM
             homer_data.sip_capture_call_%s
         WHERE
-            method = 'INVITE'
-            AND callid = '%s'
-            AND source_ip = '%s'
-            AND source_port = %d
-        """ % (today, self.call_id, self.source_ip, self.source_port)
+            method = 'INVITE'"""
+
+_INVITE_QUERY = _SELECT_INVITES + """
+            AND callid = %%s
+            AND source_ip = %%s
+            AND source_port = %%s
+        """
+
+# Many calls at once, rows are matched to calls by source afterwards.
+_INVITES_QUERY = _SELECT_INVITES + """
+            AND callid IN (%s)
+        """
+
+# Column positions in _SELECT_INVITES.
+_CALLID = 8
+_SOURCE_IP = 11
+_SOURCE_PORT = 12
+
+
+
+class TableResolver(object):
+    """Resolves Homer sip_capture_call_<date> tables where a call INVITE may be.
+
+    Candidate tables are derived from the hangup event time: its own date and
+    the date max_call_duration seconds earlier, for calls started before
+    midnight. Tables known not to exist are skipped. The set of existing
+    tables is cached and refreshed every refresh_interval seconds, or sooner
+    when a newer date than any known table is requested.
+    """
+
+    def __init__(self, db_client, refresh_interval=300, max_call_duration=3600):
+        """
+
+        :param db_client: A mysql_client.MySQLClient.
+        :param refresh_interval: (float) Seconds between table list refreshes.
+        :param max_call_duration: (float) Seconds a call may last before hangup.
+        """
+        self._db_client = db_client
+        self._refresh_interval = refresh_interval
+        self._max_call_duration = max_call_duration
+        self._lock = threading.Lock()
+        self._dates = set()
+        self._refreshed = 0
+
+    def refresh(self):
+        """Reloads existing table dates. Keeps the previous ones on error."""
+        with self._lock:
+            self._refreshed = time.time()
+            try:
+                rows = self._db_client.query_many(_TABLES_QUERY)
+            except Exception as e:
+                logging.error('Unable to list Homer tables: %s' % e)
+                return
+            self._dates = {row[0][len(_TABLE_PREFIX):] for row in rows or ()}
+
+    def _exists(self, date):
+        age = time.time() - self._refreshed
+        if age > self._refresh_interval or (date not in self._dates and age > _MIN_REFRESH_INTERVAL and
+                                            date > max(self._dates or [''])):
+            self.refresh()
+        # Without table list, try it anyway.
+        return not self._dates or date in self._dates
+
+    def dates(self, timestamp=None):
+        """Returns candidate table dates for a call hung up at timestamp, most likely first.
+
+        :param timestamp: (float) Hangup time in seconds since epoch, now if None.
+        :return: (list) Dates as YYYYMMDD.
+        """
+        timestamp = timestamp or time.time()
+        candidates = []
+        for candidate in (timestamp, timestamp - self._max_call_duration):
+            date = _TableDate(candidate)
+            if date not in candidates and self._exists(date):
+                candidates.append(date)
+        return candidates
+
+
+def _TableDate(timestamp):
+    """Returns Homer table date of a timestamp, Homer uses UTC."""
+    return datetime.datetime.fromtimestamp(timestamp, pytz.UTC).strftime('%Y%m%d')
+
+
+def _TableDates(call, resolver):
+    if resolver:
+        return resolver.dates(call.timestamp)
+    return [_TableDate(call.timestamp or time.time())]
+
+
+class Call(object):
+    def __init__(self, call_id, source_ip, source_port, timestamp=None):
+        """
+
+        :param call_id:
+        :param source_ip:
+        :param source_port:
+        :param timestamp: (float) Hangup time, seconds since epoch. Now if None.
+        """
+        self.call_id = call_id
+        self.source_ip = source_ip
+        self.source_port = source_port
+        self.timestamp = timestamp
+
+    def GetCallInfo(self, db_client, resolver=None):
+        """
+
+        :param db_client:
+        :param resolver: A TableResolver. Without it, only the table of the call date is queried.
+        :return:
+        """
+        for date in _TableDates(self, resolver):
+            row = db_client.query(_INVITE_QUERY % date, (self.call_id, self.source_ip, self.source_port))
+            if row:
+                return row
+
+
+def GetCallInfo(db_client, call, resolver=None):
+    """Same as call.GetCallInfo, with the signature of CachedCalls.GetCallInfo."""
+    return call.GetCallInfo(db_client, resolver)
+
+
+def _GetCallsInfoFromTable(db_client, date, calls):
+    wanted = {(call.call_id, call.source_ip, int(call.source_port)) for call in calls}
+    call_ids = sorted({call.call_id for call in calls})
+    query = _INVITES_QUERY % (date, ', '.join(['%s'] * len(call_ids)))
+    calls_info = {}
+    for row in db_client.query_many(query, tuple(call_ids)) or ():
+        # Same Call-ID may have been used from other sources.
+        if (row[_CALLID], row[_SOURCE_IP], int(row[_SOURCE_PORT])) in wanted:
+            calls_info.setdefault(row[_CALLID], row)
+    return calls_info
+
+
+def GetCallsInfo(db_client, calls, resolver=None):
+    """Gets call information for many calls with a single query per table.
+
+    Calls are first looked up in their most likely table, calls not found
+    there are looked up in their next candidate table.
+
+    :param db_client: A mysql_client.MySQLClient.
+    :param calls: (list) Call objects.
+    :param resolver: A TableResolver. Without it, only the table of the call date is queried.
+    :return: (dict) call_id -> row, only for calls found in Database.
+    """
+    candidates = [(call, _TableDates(call, resolver)) for call in calls]
+    calls_info = {}
+    attempt = 0
+    while candidates:
+        calls_by_date = collections.defaultdict(list)
+        for call, dates in candidates:
+            if attempt < len(dates):
+                calls_by_date[dates[attempt]].append(call)
+        for date, date_calls in calls_by_date.iteritems():
+            calls_info.update(_GetCallsInfoFromTable(db_client, date, date_calls))
+        candidates = [(call, dates) for call, dates in candidates
+                      if call.call_id not in calls_info and attempt + 1 < len(dates)]
+        attempt += 1
+    return calls_info
+
+
+def _CacheKey(call):
+    return call.call_id, call.source_ip, int(call.source_port)
+
+
+class CachedCalls(object):
+    """Read-through cache of INVITE rows in front of GetCallInfo and GetCallsInfo.
+
+    Calls not found are cached as negative entries, which should expire
+    before the call is retried.
+    """
+
+    def __init__(self, cache):
+        """
+
+        :param cache: A utils.lru_cache.LRUCache.
+        """
+        self.cache = cache
+
+    def GetCallInfo(self, db_client, call, resolver=None):
+        row = self.cache.get(_CacheKey(call))
+        if row is lru_cache.MISSING:
+            row = call.GetCallInfo(db_client, resolver)
+            self.cache.put(_CacheKey(call), row)
+        return row
 
-        return db_client.query(query)
+    def GetCallsInfo(self, db_client, calls, resolver=None):
+        calls_info = {}
+        missing = []
+        for call in calls:
+            row = self.cache.get(_CacheKey(call))
+            if row is lru_cache.MISSING:
+                missing.append(call)
+            elif row:
+                calls_info[call.call_id] = row
+        if missing:
+            found = GetCallsInfo(db_client, missing, resolver)
+            for call in missing:
+                self.cache.put(_CacheKey(call), found.get(call.call_id))
+            calls_info.update(found)
+        return calls_info
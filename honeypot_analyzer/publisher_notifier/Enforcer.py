@@ -0,0 +1,196 @@
+"""Subscriber side enforcement of threat notifications.
+
+Threat IPs reported by any honeypot are deduplicated into a blocklist with
+expiry. Block and unblock actions are applied by a Sink in batches, at most
+once every interval seconds, so a sweep reported by many honeypots turns into
+a few firewall updates instead of one per message.
+"""
+
+import socket
+import subprocess
+import threading
+import time
+
+from absl import logging
+
+_FAMILIES = (socket.AF_INET, socket.AF_INET6)
+
+
+def _family(address):
+    """Returns socket family of address or None if it is not an IP address."""
+    for family in _FAMILIES:
+        try:
+            socket.inet_pton(family, address)
+            return family
+        except (socket.error, ValueError, TypeError):
+            continue
+    return None
+
+
+def threat_ips(message):
+    """Yields attacker IPs of a notification.
+
+    :param message: A call_info dict, a list of them (batched) or anything else (ignored).
+    """
+    if isinstance(message, dict):
+        message = [message]
+    if not isinstance(message, list):
+        return
+    for call_info in message:
+        if isinstance(call_info, dict) and call_info.get('RemoteIpv4'):
+            yield call_info['RemoteIpv4']
+
+
+class Sink(object):
+    """Applies block/unblock actions."""
+
+    def apply(self, blocks, unblocks):
+        """
+
+        :param blocks: (list) IPs to block.
+        :param unblocks: (list) IPs to unblock.
+        """
+        raise NotImplementedError
+
+
+class LoggingSink(Sink):
+    """Only logs actions. Useful for dry runs."""
+
+    def apply(self, blocks, unblocks):
+        logging.info('Block: %s Unblock: %s' % (blocks, unblocks))
+
+
+class IpsetSink(Sink):
+    """Writes an 'ipset restore' file per batch and optionally applies it.
+
+    IPv4 addresses go to set_name, IPv6 addresses to set_name6.
+    """
+
+    def __init__(self, path, set_name='honeypot', set_name6='honeypot6', apply_command=False):
+        """
+
+        :param path: (str) Restore file, rewritten on every batch.
+        :param set_name: (str) ipset hash:ip set for IPv4.
+        :param set_name6: (str) ipset hash:ip set for IPv6.
+        :param apply_command: (bool) Run 'ipset restore' with the file.
+        """
+        self._path = path
+        self._sets = {socket.AF_INET: set_name, socket.AF_INET6: set_name6}
+        self._apply_command = apply_command
+
+    def restore_lines(self, blocks, unblocks):
+        lines = ['create %s hash:ip family inet -exist' % self._sets[socket.AF_INET],
+                 'create %s hash:ip family inet6 -exist' % self._sets[socket.AF_INET6]]
+        for command, addresses in (('add', blocks), ('del', unblocks)):
+            for address in addresses:
+                lines.append('%s %s %s -exist' % (command, self._sets[_family(address)], address))
+        return lines
+
+    def apply(self, blocks, unblocks):
+        with open(self._path, 'w') as restore_file:
+            restore_file.write('\n'.join(self.restore_lines(blocks, unblocks)) + '\n')
+        if self._apply_command:
+            subprocess.check_call(['ipset', 'restore', '-file', self._path])
+        logging.info('ipset: %d blocked %d unblocked' % (len(blocks), len(unblocks)))
+
+
+class Enforcer(object):
+    """Deduplicated blocklist with expiry, flushed in batches to a Sink."""
+
+    def __init__(self, sink, ttl=3600, interval=1.0, max_batch_size=1000, whitelist=None):
+        """
+
+        :param sink: A Sink.
+        :param ttl: (float) Seconds an IP stays blocked after its last notification.
+        :param interval: (float) Minimum seconds between Sink updates.
+        :param max_batch_size: (int) Maximum blocks plus unblocks per Sink update.
+        :param whitelist: Container of IPs never blocked, e.g. whitelist.Whitelist.
+        """
+        self._sink = sink
+        self._ttl = ttl
+        self._interval = interval
+        self._max_batch_size = max_batch_size
+        self._whitelist = whitelist or ()
+        self._lock = threading.Lock()
+        # IP -> expiration time, for IPs blocked or about to be.
+        self._expires = {}
+        self._pending_blocks = []
+        self._stop = threading.Event()
+        self._thread = None
+        self.notifications = 0
+        self.duplicates = 0
+        self.blocked = 0
+        self.unblocked = 0
+        self.errors = 0
+
+    def __len__(self):
+        return len(self._expires)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='enforcer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def handle(self, channel, message, now=None):
+        """Adds threat IPs of message to blocklist. Transport listener."""
+        now = now or time.time()
+        with self._lock:
+            for ip in threat_ips(message):
+                self.notifications += 1
+                if ip in self._expires:
+                    self.duplicates += 1
+                elif _family(ip) is None or ip in self._whitelist:
+                    logging.warning('Ignoring threat IP: %s' % ip)
+                    continue
+                else:
+                    self._pending_blocks.append(ip)
+                self._expires[ip] = now + self._ttl
+
+    def flush(self, now=None):
+        """Applies pending blocks and expired unblocks, up to max_batch_size."""
+        now = now or time.time()
+        with self._lock:
+            blocks = self._pending_blocks[:self._max_batch_size]
+            del self._pending_blocks[:len(blocks)]
+            pending = set(self._pending_blocks)
+            unblocks = []
+            for ip, expires in self._expires.items():
+                if len(blocks) + len(unblocks) >= self._max_batch_size:
+                    break
+                # IPs still waiting to be blocked are kept, only expired blocked IPs are unblocked.
+                if expires <= now and ip not in pending:
+                    unblocks.append(ip)
+                    del self._expires[ip]
+        if not blocks and not unblocks:
+            return
+        try:
+            self._sink.apply(blocks, unblocks)
+            self.blocked += len(blocks)
+            self.unblocked += len(unblocks)
+        except Exception as e:
+            self.errors += 1
+            logging.exception('Unable to apply enforcement: %s' % e)
+            with self._lock:
+                # Retry on next flush, unless notified again meanwhile.
+                self._pending_blocks[:0] = [ip for ip in blocks if ip in self._expires]
+                for ip in unblocks:
+                    self._expires.setdefault(ip, now)
+
+    def stats(self):
+        return {'blocklist': len(self._expires),
+                'pending_blocks': len(self._pending_blocks),
+                'notifications': self.notifications,
+                'duplicates': self.duplicates,
+                'blocked': self.blocked,
+                'unblocked': self.unblocked,
+                'errors': self.errors}
+
+    def _run(self):
+        while not self._stop.wait(self._interval):
+            self.flush()
+        self.flush()
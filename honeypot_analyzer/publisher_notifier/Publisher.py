@@ -1,6 +1,7 @@
 
 
 from absl import app
+from absl import flags
 from absl import logging
 
 
@@ -9,11 +10,16 @@ from pubnub.enums import PNStatusCategory
 from pubnub.pnconfiguration import PNConfiguration
 from pubnub.pubnub import PubNub
 
+from honeypot_analyzer.publisher_notifier import Broker
+from honeypot_analyzer.publisher_notifier import Transport
 
 CHANNEL = 'honeypot'
+PUBNUB = 'pubnub'
+BROKER = 'broker'
+TRANSPORTS = (PUBNUB, BROKER)
 # TODO Environment Variables
 
-
+FLAGS = flags.FLAGS
 
 
 def GetConfig():
@@ -73,12 +79,20 @@ class MySubscribeCallback(SubscribeCallback):
         logging.info('Received message: %s' % msg)
 
 
+def TransportCallBack(error):
+    if error:
+        logging.error('Message failed to be published: %s' % error)
+    else:
+        logging.info('Message successfully published to specified channel')
+
+
 class Publisher(object):
-    """PubNub Class to send messages to subscribers."""
+    """Class to send messages to subscribers. Uses PubNub unless a transport is given."""
 
-    def __init__(self, pnconfig):
+    def __init__(self, pnconfig, transport=None):
         self._pnconfig = pnconfig
-        self._pubnub = PubNub(self._pnconfig)
+        self._transport = transport
+        self._pubnub = None if transport else PubNub(self._pnconfig)
 
     def publish(self, channel, message):
         if not channel:
@@ -86,16 +100,62 @@ class Publisher(object):
         if not message:
             raise ValueError('Invalid message')
 
+        if self._transport:
+            self._transport.send(channel, message, TransportCallBack)
+            return
         self._pubnub.publish().channel(channel).message(message).async(PublisherCallBack)
 
 
+class PubNubTransport(Transport.Transport):
+    """Transport over PubNub, used by BatchPublisher."""
+
+    def __init__(self, pnconfig):
+        self._pubnub = PubNub(pnconfig)
+
+    def send(self, channel, message, callback):
+        def publish_callback(envelope, status):
+            if status.is_error():
+                callback(Transport.TransportError('PubNub error category: %s' % status.category))
+            else:
+                callback(None)
+
+        self._pubnub.publish().channel(channel).message(message).async(publish_callback)
+
+    def close(self):
+        self._pubnub.stop()
+
+
+def GetTransport(transport, pnconfig=None, broker_address=Broker.DEFAULT_ADDRESS):
+    """Returns Transport.Transport instance.
+
+    :param transport: (str) PUBNUB or BROKER.
+    :param pnconfig: PNConfiguration, used by PUBNUB.
+    :param broker_address: (str) Broker.BrokerServer address, used by BROKER.
+    :return:
+    """
+    if transport == PUBNUB:
+        if not isinstance(pnconfig, PNConfiguration):
+            raise ValueError('Invalid PubNub configuration')
+        return PubNubTransport(pnconfig)
+    if transport == BROKER:
+        return Broker.BrokerTransport(broker_address)
+    raise ValueError('Invalid transport: %s' % transport)
+
+
 def main(_):
     pnconfig = GetConfig()
     if not isinstance(pnconfig, PNConfiguration):
         raise ValueError('Invalid configuration')
-    pubnub = Publisher(pnconfig)
-    pubnub.publish(CHANNEL, {"From": pnconfig.uuid, "Content": "IP Address found"})
+    transport = None
+    if FLAGS.transport != PUBNUB:
+        transport = GetTransport(FLAGS.transport, pnconfig, FLAGS.broker_address)
+    publisher = Publisher(pnconfig, transport)
+    publisher.publish(CHANNEL, {"From": pnconfig.uuid, "Content": "IP Address found"})
+    if transport:
+        transport.close()
 
 
 if __name__ == '__main__':
+    flags.DEFINE_enum('transport', PUBNUB, TRANSPORTS, 'Notification transport')
+    flags.DEFINE_string('broker_address', Broker.DEFAULT_ADDRESS, "Broker address, 'host:port' or 'unix:/path'")
     app.run(main)
@@ -1,4 +1,7 @@
+import functools
+
 from absl import app
+from absl import flags
 from absl import logging
 
 from pubnub.callbacks import SubscribeCallback
@@ -6,7 +9,15 @@ from pubnub.enums import PNStatusCategory
 from pubnub.pnconfiguration import PNConfiguration
 from pubnub.pubnub import PubNub
 
+from honeypot_analyzer.publisher_notifier import Broker
+from honeypot_analyzer.publisher_notifier import Enforcer
+from honeypot_server.conf import whitelist
+
 CHANNEL = 'honeypot'
+PUBNUB = 'pubnub'
+BROKER = 'broker'
+
+FLAGS = flags.FLAGS
 
 
 def PublisherCallBack(envelope, status):
@@ -21,6 +32,10 @@ def PublisherCallBack(envelope, status):
 
 
 class MySubscribeCallback(SubscribeCallback):
+    def __init__(self, listener=None):
+        super(MySubscribeCallback, self).__init__()
+        self._listener = listener or HandleMessage
+
     def presence(self, pubnub, presence):
         pass  # handle incoming presence data
 
@@ -46,18 +61,56 @@ class MySubscribeCallback(SubscribeCallback):
 
     def message(self, pubnub, message):
         """Handle new message stored in message.message"""
-        msg = message.message
-        logging.info('Received message: %s' % msg)
+        self._listener(CHANNEL, message.message)
+
+
+def HandleMessage(channel, msg, enforcer=None):
+    """Handle new message, regardless of transport."""
+    logging.info('Received message: %s' % msg)
+    if enforcer:
+        enforcer.handle(channel, msg)
+
+
+def GetEnforcer():
+    """Returns Enforcer.Enforcer configured by flags or None."""
+    if not FLAGS.enforce:
+        return None
+    if FLAGS.enforce == 'ipset':
+        sink = Enforcer.IpsetSink(FLAGS.ipset_file, FLAGS.ipset_name, FLAGS.ipset_name6, FLAGS.ipset_apply)
+    else:
+        sink = Enforcer.LoggingSink()
+    return Enforcer.Enforcer(sink, ttl=FLAGS.block_ttl, interval=FLAGS.enforce_interval,
+                             max_batch_size=FLAGS.enforce_batch_size,
+                             whitelist=whitelist.Whitelist(FLAGS.whitelist_file))
 
 
 def main(_):
+    enforcer = GetEnforcer()
+    if enforcer:
+        enforcer.start()
+    listener = functools.partial(HandleMessage, enforcer=enforcer)
+    if FLAGS.transport == BROKER:
+        # Blocks, reconnecting to broker when connection is lost.
+        Broker.BrokerSubscriber(FLAGS.broker_address, CHANNEL, listener).run()
+        return
     pnconfig = PNConfiguration()
     pnconfig.publish_key = 'pub-c-ef4b6aa1-d5ca-43f8-92c8-f9840fb5bb9f'
     pnconfig.subscribe_key = 'sub-c-151a8936-0fc7-11e8-941f-7e2964818bdb'
     pubnub = PubNub(pnconfig)
-    pubnub.add_listener(MySubscribeCallback())
+    pubnub.add_listener(MySubscribeCallback(listener))
     pubnub.subscribe().channels(CHANNEL).execute()
 
 
 if __name__ == '__main__':
+    flags.DEFINE_enum('transport', PUBNUB, [PUBNUB, BROKER], 'Notification transport')
+    flags.DEFINE_string('broker_address', Broker.DEFAULT_ADDRESS, "Broker address, 'host:port' or 'unix:/path'")
+    flags.DEFINE_enum('enforce', None, ['log', 'ipset'], 'Block threat IPs using this sink')
+    flags.DEFINE_float('block_ttl', 3600, 'Seconds a threat IP stays blocked after its last notification')
+    flags.DEFINE_float('enforce_interval', 1.0, 'Minimum seconds between firewall updates')
+    flags.DEFINE_integer('enforce_batch_size', 1000, 'Maximum block and unblock actions per firewall update')
+    flags.DEFINE_string('ipset_file', '/tmp/honeypot.ipset', 'ipset restore file written by ipset sink')
+    flags.DEFINE_string('ipset_name', 'honeypot', 'ipset set of blocked IPv4 addresses')
+    flags.DEFINE_string('ipset_name6', 'honeypot6', 'ipset set of blocked IPv6 addresses')
+    flags.DEFINE_bool('ipset_apply', False, "Run 'ipset restore' after writing ipset file")
+    flags.DEFINE_string('whitelist_file', None, 'File with IPs/CIDRs never blocked, in addition to WHITE_LIST')
     app.run(main)
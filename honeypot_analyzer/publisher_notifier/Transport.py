@@ -0,0 +1,58 @@
+"""Message transports used by Publisher and BatchPublisher."""
+
+import threading
+
+from absl import logging
+
+
+class TransportError(Exception):
+    """A message could not be delivered."""
+
+
+class Transport(object):
+    """Delivers messages to a channel.
+
+    send() may complete asynchronously, callback(error) is invoked once with
+    None on success or an exception on failure.
+    """
+
+    def send(self, channel, message, callback):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class LoopbackTransport(Transport):
+    """In-process stand-in broker. Keeps sent messages and fans them out to listeners.
+
+    fail_next makes the following sends fail, to exercise retries.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._listeners = []
+        self.messages = []
+        self.fail_next = 0
+
+    def subscribe(self, listener):
+        """Calls listener(channel, message) for every message delivered."""
+        with self._lock:
+            self._listeners.append(listener)
+
+    def send(self, channel, message, callback):
+        with self._lock:
+            if self.fail_next:
+                self.fail_next -= 1
+                error = TransportError('Loopback failure')
+            else:
+                error = None
+                self.messages.append((channel, message))
+            listeners = list(self._listeners)
+        if not error:
+            for listener in listeners:
+                try:
+                    listener(channel, message)
+                except Exception as e:
+                    logging.exception(e)
+        callback(error)
@@ -0,0 +1,166 @@
+"""Feature encoding shared by model training and online scoring.
+
+HoneypotData fits a FeatureEncoder on the training dataset and saves it next
+to the model weights. Online scoring loads it once and encodes a single Homer
+row with one dict lookup per categorical feature, without pandas.
+"""
+
+import json
+
+import numpy as np
+
+ENCODER_FILE = 'honeypot_encoder.json'
+
+# Columns returned by Call.GetCallInfo.
+HOMER_COLUMNS = ['ruri',
+                 'ruri_user',
+                 'ruri_domain',
+                 'from_user',
+                 'from_domain',
+                 'from_tag',
+                 'to_user',
+                 'contact_user',
+                 'callid',
+                 'content_type',
+                 'user_agent',
+                 'source_ip',
+                 'source_port',
+                 'destination_port',
+                 'contact_ip',
+                 'contact_port']
+
+LABEL_ENCODED_FEATURES = ['ruri_user', 'from_user', 'to_user', 'contact_user', 'user_agent', 'source_ip', 'contact_ip']
+NA_VALUES = {'contact_user': 'test', 'content_type': 'application/sdp'}
+SIP_SCANNERS = ('sipcli/v1.8', 'pplsip')
+IS_SCANNER = 'is_scanner'
+
+# Model input columns, same (sorted) order used by HoneypotData.preproc.
+FEATURE_COLUMNS = ['contact_ip',
+                   'contact_port',
+                   'contact_user',
+                   'from_user',
+                   IS_SCANNER,
+                   'ruri_user',
+                   'source_ip',
+                   'source_port',
+                   'to_user',
+                   'user_agent']
+
+# Code of values not seen during training, same as pandas cat.codes for NaN.
+UNKNOWN = -1
+
+_USER_AGENT = 'user_agent'
+_HOMER_INDEX = {column: index for index, column in enumerate(HOMER_COLUMNS)}
+
+
+def _is_categorical(series):
+    return str(series.dtype) == 'category'
+
+
+def _distinct_values(series):
+    """Returns set of str values of a Pandas.Series, without NaN."""
+    if _is_categorical(series):
+        # Categories in use, without converting every row to str.
+        codes = series.cat.codes.values
+        return set(str(value) for value in series.cat.categories[np.unique(codes[codes >= 0])])
+    return set(series.dropna().astype(str))
+
+
+class FeatureEncoder(object):
+    """Per column value -> code maps with an unknown bucket."""
+
+    def __init__(self, columns=None, vocabulary=None, feature_columns=None):
+        """
+
+        :param columns: (list) Label encoded columns.
+        :param vocabulary: (dict) Column -> {value: code}.
+        :param feature_columns: (list) Model input columns in order.
+        """
+        self.columns = list(columns or LABEL_ENCODED_FEATURES)
+        self.vocabulary = vocabulary or {}
+        self.feature_columns = list(feature_columns or FEATURE_COLUMNS)
+
+    def fit(self, dataset):
+        """Builds codes from a Pandas.dataframe. Codes follow the string sort order of str(value).
+
+        :param dataset: A Pandas.dataframe.
+        :return: self.
+        """
+        return self.fit_chunks([dataset])
+
+    def fit_chunks(self, chunks):
+        """Builds codes from Pandas.dataframe chunks, keeping only distinct values in memory.
+
+        :param chunks: Iterable of Pandas.dataframe.
+        :return: self.
+        """
+        values = {column: set() for column in self.columns}
+        for chunk in chunks:
+            for column in self.columns:
+                values[column].update(_distinct_values(chunk[column]))
+        self.vocabulary = {column: {value: code for code, value in enumerate(sorted(values[column]))}
+                           for column in self.columns}
+        return self
+
+    def transform(self, dataset):
+        """Replaces label encoded columns of a Pandas.dataframe with their codes."""
+        for column in self.columns:
+            dataset[column] = dataset[column].astype(str).map(self.vocabulary[column]).fillna(UNKNOWN).astype('int32')
+        return dataset
+
+    def to_matrix(self, dataset):
+        """Builds the model input of a Pandas.dataframe in one pass over its columns.
+
+        Label encoded columns are looked up once per category, rows only index the lookup.
+
+        :param dataset: A Pandas.dataframe, preferably with categorical dtypes.
+        :return: A float32 numpy array with feature_columns in order.
+        """
+        matrix = np.empty((len(dataset), len(self.feature_columns)), dtype=np.float32)
+        for index, column in enumerate(self.feature_columns):
+            series = dataset[column]
+            if column in self.vocabulary:
+                if not _is_categorical(series):
+                    series = series.astype('category')
+                vocabulary = self.vocabulary[column]
+                # Last entry is used by missing values, code -1.
+                lookup = np.array([vocabulary.get(str(value), UNKNOWN) for value in series.cat.categories] + [UNKNOWN],
+                                  dtype=np.float32)
+                matrix[:, index] = lookup[series.cat.codes.values]
+            else:
+                matrix[:, index] = np.nan_to_num(series.values.astype(np.float32))
+        return matrix
+
+    def encode(self, column, value):
+        """Returns code of a single value."""
+        return self.vocabulary[column].get(value, UNKNOWN)
+
+    def vectorize(self, row):
+        """Converts a Homer row into the model feature vector.
+
+        :param row: (list) Values in HOMER_COLUMNS order.
+        :return: A float32 numpy array.
+        """
+        vector = np.empty(len(self.feature_columns), dtype=np.float32)
+        for index, column in enumerate(self.feature_columns):
+            if column == IS_SCANNER:
+                vector[index] = row[_HOMER_INDEX[_USER_AGENT]] in SIP_SCANNERS
+                continue
+            value = row[_HOMER_INDEX[column]] or NA_VALUES.get(column, '')
+            if column in self.vocabulary:
+                vector[index] = self.vocabulary[column].get(value, UNKNOWN)
+            else:
+                vector[index] = float(value) if value else 0
+        return vector
+
+    def save(self, path=ENCODER_FILE):
+        with open(path, 'w') as encoder_file:
+            json.dump({'columns': self.columns,
+                       'vocabulary': self.vocabulary,
+                       'feature_columns': self.feature_columns}, encoder_file)
+
+    @classmethod
+    def load(cls, path=ENCODER_FILE):
+        with open(path) as encoder_file:
+            config = json.load(encoder_file)
+        return cls(config['columns'], config['vocabulary'], config['feature_columns'])
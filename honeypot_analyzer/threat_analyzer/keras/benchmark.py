@@ -0,0 +1,113 @@
+"""Compares honeypot classifier backends on honeypot_dataset.csv.
+
+All backends are trained on the same HoneypotData split and evaluated on the
+validation rows, with the engine local_prediction serves them with: Keras
+weights run on numpy_engine, scikit-learn models on sklearn_engine.
+
+    python benchmark.py --backends=keras,logistic,gradient_boosting,random_forest --epochs=1
+"""
+
+import cPickle as pickle
+import os
+import tempfile
+import time
+
+import numpy as np
+from absl import app
+from absl import flags
+
+import honeypot_predictor
+
+from honeypot_analyzer.threat_analyzer import numpy_engine
+from honeypot_analyzer.threat_analyzer import sklearn_engine
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_list('backends', [honeypot_predictor.KERAS] + list(sklearn_engine.BACKENDS), 'Backends to compare')
+flags.DEFINE_integer('epochs', 1, 'Keras training epochs')
+flags.DEFINE_integer('latency_rows', 1000, 'Single row predictions timed per backend')
+flags.DEFINE_integer('batch_rows', 100000, 'Rows per batch when measuring throughput')
+flags.DEFINE_string('output', None, 'Optional CSV file with results')
+
+COLUMNS = ('backend', 'accuracy', 'detection_rate', 'false_positive_rate', 'train_seconds', 'latency_p50_ms',
+           'latency_p99_ms', 'rows_per_second', 'model_bytes')
+
+
+def _train_keras():
+    """Returns (engine, model bytes, X_valid, y_valid, train seconds)."""
+    model = honeypot_predictor.HoneypotKeras()
+    model.build_model()
+    start = time.time()
+    model.fit(lr=0.01, epochs=FLAGS.epochs)
+    train_seconds = time.time() - start
+    handle, path = tempfile.mkstemp(suffix='.npz')
+    os.close(handle)
+    try:
+        numpy_engine.export(model.model, path)
+        engine = numpy_engine.load(path)
+        size = os.path.getsize(path)
+    finally:
+        os.remove(path)
+    return engine, size, model.X_valid, model.y_valid.argmax(axis=1), train_seconds
+
+
+def _train_sklearn(backend):
+    """Returns (engine, model bytes, X_valid, y_valid, train seconds)."""
+    model = honeypot_predictor.HoneypotSklearn(backend)
+    model.build_model()
+    start = time.time()
+    model.fit()
+    train_seconds = time.time() - start
+    size = len(pickle.dumps(model.model, pickle.HIGHEST_PROTOCOL))
+    return sklearn_engine.SklearnEngine(model.model), size, model.X_valid, model.y_valid, train_seconds
+
+
+def evaluate(backend):
+    """Trains backend and returns a dict with COLUMNS."""
+    if backend == honeypot_predictor.KERAS:
+        engine, size, X_valid, y_valid, train_seconds = _train_keras()
+    else:
+        engine, size, X_valid, y_valid, train_seconds = _train_sklearn(backend)
+
+    predictions = engine.predict_labels(X_valid)
+    positives = y_valid == 1
+    negatives = ~positives
+
+    latencies = []
+    for index in range(FLAGS.latency_rows):
+        row = X_valid[index % len(X_valid)]
+        start = time.time()
+        engine.predict(row)
+        latencies.append(time.time() - start)
+
+    batch = np.resize(X_valid, (FLAGS.batch_rows, X_valid.shape[1]))
+    start = time.time()
+    engine.predict(batch)
+    batch_seconds = time.time() - start
+
+    return {'backend': backend,
+            'accuracy': float(np.mean(predictions == y_valid)),
+            'detection_rate': float(np.mean(predictions[positives] == 1)) if positives.any() else float('nan'),
+            'false_positive_rate': float(np.mean(predictions[negatives] == 1)) if negatives.any() else float('nan'),
+            'train_seconds': train_seconds,
+            'latency_p50_ms': np.percentile(latencies, 50) * 1000,
+            'latency_p99_ms': np.percentile(latencies, 99) * 1000,
+            'rows_per_second': FLAGS.batch_rows / batch_seconds,
+            'model_bytes': size}
+
+
+def main(_):
+    results = [evaluate(backend) for backend in FLAGS.backends]
+    print ' '.join('%20s' % column for column in COLUMNS)
+    for result in results:
+        print ' '.join('%20s' % result[column] if isinstance(result[column], str) else '%20.4f' % result[column]
+                       for column in COLUMNS)
+    if FLAGS.output:
+        with open(FLAGS.output, 'w') as output:
+            output.write(','.join(COLUMNS) + '\n')
+            for result in results:
+                output.write(','.join(str(result[column]) for column in COLUMNS) + '\n')
+
+
+if __name__ == '__main__':
+    app.run(main)
@@ -1,7 +1,11 @@
 """Honeypot classifier. Based on https://www.kaggle.com/mrklees/applying-keras-scikit-learn-to-titanic"""
 
+import math
+
 import pandas as pd
 import numpy as np
+from absl import app
+from absl import flags
 
 from keras.utils import to_categorical
 from keras.models import Sequential
@@ -9,7 +13,9 @@ from keras.layers import Dense, Dropout
 
 from sklearn.model_selection import train_test_split
 
-pd.options.mode.chained_assignment = None
+from honeypot_analyzer.threat_analyzer import encoder
+from honeypot_analyzer.threat_analyzer import numpy_engine
+from honeypot_analyzer.threat_analyzer import sklearn_engine
 
 FILENAME = '../data/honeypot_dataset.csv'
 
@@ -53,14 +59,26 @@ SIP_SCANNERS = ('sipcli/v1.8', 'pplsip')
 _USER_AGENT = 'user_agent'
 LABEL = 'toll_fraud'
 
+# Typed at read time: strings as categories, read once per distinct value.
+DTYPES = dict([(column, 'category') for column in CATEGORICAL] +
+              [(column, np.float32) for column in CONTINUOUS] +
+              [(LABEL, np.int8)])
+
 MODEL_NAME = 'honeypot.json'
 MODEL_WEIGHTS = 'honeypot.h5'
+MODEL_NPZ = numpy_engine.MODEL_NPZ
+MODEL_PKL = sklearn_engine.MODEL_PKL
+KERAS = 'keras'
+MODEL_ENCODER = encoder.ENCODER_FILE
 
+FLAGS = flags.FLAGS
 
-def save_model(model):
+
+def save_model(model, feature_encoder=None):
     """
 
     :param model: A Keras model.
+    :param feature_encoder: The encoder.FeatureEncoder used to train model.
     :return:
     """
     model_json = model.to_json()
@@ -68,6 +86,23 @@ def save_model(model):
         json_file.write(model_json)
     # serialize weights to HDF5
     model.save_weights(MODEL_WEIGHTS)
+    # Weights for numpy_engine, served without Keras.
+    numpy_engine.export(model, MODEL_NPZ)
+    # Categorical codes used by online scoring.
+    if feature_encoder:
+        feature_encoder.save(MODEL_ENCODER)
+    print("Saved model to disk")
+
+
+def save_sklearn_model(model, feature_encoder):
+    """
+
+    :param model: A fitted scikit-learn estimator.
+    :param feature_encoder: The encoder.FeatureEncoder used to train model.
+    :return:
+    """
+    sklearn_engine.save(MODEL_PKL, model)
+    feature_encoder.save(MODEL_ENCODER)
     print("Saved model to disk")
 
 
@@ -121,16 +156,18 @@ class HoneypotData(object):
         # Feature Engineering.
         dataset = self.engineer_features(dataset)
 
-        # Process Categorical values processing.
-        dataset = self.process_categorical(dataset)
+        # Fit categorical codes, reused for test data and online scoring.
+        self.encoder = encoder.FeatureEncoder(LABEL_ENCODED_FEATURES).fit(dataset)
+        # All columns except target, sorted.
+        self.encoder.feature_columns = sorted(dataset.columns.difference([LABEL]))
 
-        # Select all columns except target.
-        X = dataset[dataset.columns.difference([LABEL])]
-        y = dataset[LABEL]
+        # Process Categorical values processing.
+        X = self.process_categorical(dataset)
+        y = dataset[LABEL].values
 
         # Split training and test datasets.
         X_train, X_valid, y_train, y_valid = train_test_split(X, y, test_size=0.25, random_state=606, stratify=y)
-        return X_train.astype('float32'), y_train.values, X_valid.astype('float32'), y_valid.values
+        return X_train, y_train, X_valid, y_valid
 
     def import_data(self, filename, drop=True):
         """Import that data and then split it into train/test sets. Make sure to stratify.
@@ -147,58 +184,41 @@ class HoneypotData(object):
         Returns:
             A Pandas.dataframe.
         """
-
-        dataset = pd.read_csv('%s%s' % (self.filepath, filename))
-
-        if drop:
-            # Drop irrelevant features.
-            return dataset.drop(DROPPED_FEATURES, axis=1)
-        else:
-            return dataset
+        # Irrelevant features are not read.
+        usecols = (lambda column: column not in DROPPED_FEATURES) if drop else None
+        return pd.read_csv('%s%s' % (self.filepath, filename), usecols=usecols, dtype=DTYPES)
 
     def fix_na(self, dataset):
         """Fill na's with test (in the case of contact_user), and with application/sdp in the case of content_type."""
 
         na_vars = {"contact_user": "test", "content_type": "application/sdp"}
-        return dataset.fillna(na_vars)
+        for column, value in na_vars.items():
+            if column not in dataset or not dataset[column].isnull().any():
+                continue
+            if value not in dataset[column].cat.categories:
+                dataset[column] = dataset[column].cat.add_categories([value])
+            dataset[column] = dataset[column].fillna(value)
+        return dataset
 
     def engineer_features(self, dataset):
         """Modify some features."""
 
-        dataset['is_scanner'] = 0  # Initialize to no/0 is scanner.
-        dataset['is_scanner'].loc[dataset[_USER_AGENT].isin(SIP_SCANNERS)] = 1  # The rest are 0.
+        dataset[encoder.IS_SCANNER] = dataset[_USER_AGENT].isin(SIP_SCANNERS).astype(np.int8)
         return dataset
 
     def process_categorical(self, dataset):
-        """
+        """Label encodes LABEL_ENCODED_FEATURES with the encoder fitted in preproc.
 
         :param dataset:
-        :return:
+        :return: A float32 numpy array with encoder.feature_columns.
         """
-        # Label Encoding.
-        for categorical_feature in LABEL_ENCODED_FEATURES:
-            categorical_feature = _to_string(categorical_feature)
-            dataset[categorical_feature] = dataset[categorical_feature].astype('category')
-            dataset[categorical_feature + '_cat'] = dataset[categorical_feature].cat.codes
-        # Drop previous values.
-        dataset = dataset.drop(LABEL_ENCODED_FEATURES, axis=1)
-        # Rename back categories. {'to_user_cat': 'to_user' ... }
-        dataset.rename(columns={c + '_cat': c for c in LABEL_ENCODED_FEATURES}, inplace=True)
-        return dataset
+        return self.encoder.to_matrix(dataset)
 
     def preproc_test(self):
         """Pre-process testing data."""
 
         # Import data
         test = self.import_data(self.test_fn, drop=True)
-        # Extract labels.
-        # Drop previous values.
-        test[_USER_AGENT] = test[_USER_AGENT].astype('category')
-        test['user_agent_cat'] = test[_USER_AGENT].cat.codes
-        print test[['user_agent_cat', _USER_AGENT]].head()
-        test = test.drop([_USER_AGENT], axis=1)
-        test.rename(columns={'user_agent_cat': _USER_AGENT}, inplace=True)
-        labels = test.user_agent.values
 
         # Fix NA values.
         test = self.fix_na(test)
@@ -206,8 +226,10 @@ class HoneypotData(object):
         # Feature Engineering
         test = self.engineer_features(test)
 
-        # Process Categorical values processing.
+        # Process Categorical values processing, same codes as training data.
         test = self.process_categorical(test)
+        # Extract labels, user agent codes.
+        labels = test[:, self.encoder.feature_columns.index(_USER_AGENT)]
         return labels, test
 
 
@@ -254,8 +276,163 @@ class HoneypotKeras(HoneypotData):
         return subm
 
 
-model = HoneypotKeras()
-model.build_model()
-model.fit(lr=0.01, epochs=1)
-#model.fit(lr=0.001, epochs=10)
-model.prepare_submission('keras')
+class HoneypotSklearn(HoneypotData):
+    """scikit-learn classifier, see sklearn_engine.BACKENDS."""
+
+    def __init__(self, backend=sklearn_engine.LOGISTIC):
+        self.backend = backend
+        self.X_train, self.y_train, self.X_valid, self.y_valid = self.preproc()
+        self.feature_count = self.X_train.shape[1]
+
+    def build_model(self):
+        print 'Feature count: %d' % self.feature_count
+        self.model = sklearn_engine.build(self.backend)
+
+    def fit(self):
+        self.model.fit(self.X_train, self.y_train)
+        print 'Validation accuracy: %f' % self.model.score(self.X_valid, self.y_valid)
+
+    def prepare_submission(self, name):
+        labels, test_data = self.preproc_test()
+        predictions = self.model.predict_proba(test_data)
+        subm = pd.DataFrame(np.column_stack([labels, np.around(predictions[:, 1])]).astype('int32'),
+                            columns=[_USER_AGENT, LABEL])
+        subm.to_csv('%s.csv' % name, index=False)
+        return subm
+
+
+class HoneypotStreamData(HoneypotData):
+    """Honeypot Data read in chunks, for datasets larger than memory.
+
+    A first pass over the dataset fits the encoder (unless one is given) and
+    picks a stratified holdout from the labels; only labels and the holdout
+    mask, one byte per row each, stay in memory. Batches are then encoded
+    chunk by chunk on every epoch.
+    """
+    chunk_size = 100000
+
+    def __init__(self, batch_size=32, holdout=0.05, feature_encoder=None, random_state=606):
+        """
+
+        :param batch_size: (int) Rows per batch.
+        :param holdout: (float) Fraction of rows used for validation.
+        :param feature_encoder: Pre-fitted encoder.FeatureEncoder, fitted on the dataset if None.
+        :param random_state: (int) Seed of holdout and shuffling.
+        """
+        self.batch_size = batch_size
+        self.encoder = feature_encoder
+        self._random = np.random.RandomState(random_state)
+        self.holdout_mask = self.sample(holdout, random_state)
+
+    def read_chunks(self):
+        """Yields prepared Pandas.dataframe chunks of the training dataset."""
+        chunks = pd.read_csv('%s%s' % (self.filepath, self.train_fn), dtype=DTYPES, chunksize=self.chunk_size,
+                             usecols=lambda column: column not in DROPPED_FEATURES)
+        for chunk in chunks:
+            yield self.engineer_features(self.fix_na(chunk))
+
+    def sample(self, holdout, random_state):
+        """Sampling pass. Returns boolean mask of holdout rows."""
+        labels = []
+
+        def chunks():
+            for chunk in self.read_chunks():
+                labels.append(chunk[LABEL].values)
+                if not self.encoder:
+                    # All columns except target, sorted, as in preproc.
+                    self.feature_columns = sorted(chunk.columns.difference([LABEL]))
+                yield chunk
+
+        if self.encoder:
+            for _ in chunks():
+                pass
+        else:
+            self.encoder = encoder.FeatureEncoder(LABEL_ENCODED_FEATURES).fit_chunks(chunks())
+            self.encoder.feature_columns = self.feature_columns
+        labels = np.concatenate(labels)
+        _, holdout_rows = train_test_split(np.arange(len(labels)), test_size=holdout, random_state=random_state,
+                                           stratify=labels)
+        mask = np.zeros(len(labels), dtype=bool)
+        mask[holdout_rows] = True
+        return mask
+
+    def steps(self, holdout=False):
+        """Batches per epoch."""
+        rows = np.count_nonzero(self.holdout_mask)
+        if not holdout:
+            rows = len(self.holdout_mask) - rows
+        return int(math.ceil(rows / float(self.batch_size)))
+
+    def batches(self, holdout=False):
+        """Endless generator of (features, one hot labels) batches, steps(holdout) per epoch.
+
+        :param holdout: (bool) Validation rows instead of training rows.
+        """
+        while True:
+            X_rest = np.empty((0, len(self.encoder.feature_columns)), dtype=np.float32)
+            y_rest = np.empty(0, dtype=np.int8)
+            offset = 0
+            for chunk in self.read_chunks():
+                mask = self.holdout_mask[offset:offset + len(chunk)]
+                offset += len(chunk)
+                if not holdout:
+                    mask = ~mask
+                X = np.concatenate([X_rest, self.encoder.to_matrix(chunk)[mask]])
+                y = np.concatenate([y_rest, chunk[LABEL].values[mask]])
+                if not holdout:
+                    # Shuffled within chunks only.
+                    order = self._random.permutation(len(y))
+                    X, y = X[order], y[order]
+                full = len(y) - len(y) % self.batch_size
+                for start in range(0, full, self.batch_size):
+                    yield X[start:start + self.batch_size], to_categorical(y[start:start + self.batch_size], 2)
+                X_rest, y_rest = X[full:], y[full:]
+            if len(y_rest):
+                yield X_rest, to_categorical(y_rest, 2)
+
+
+class HoneypotKerasStream(HoneypotStreamData, HoneypotKeras):
+    """HoneypotKeras trained from HoneypotStreamData batches."""
+
+    def __init__(self, batch_size=32, holdout=0.05, feature_encoder=None):
+        HoneypotStreamData.__init__(self, batch_size, holdout, feature_encoder)
+        self.feature_count = len(self.encoder.feature_columns)
+        self.history = []
+
+    def fit(self, lr=0.001, epochs=1):
+        self.model.optimizer.lr = lr
+        hist = self.model.fit_generator(self.batches(), steps_per_epoch=self.steps(),
+                                        epochs=epochs, verbose=1,
+                                        validation_data=self.batches(holdout=True),
+                                        validation_steps=self.steps(holdout=True))
+        self.history.append(hist)
+
+
+def main(_):
+    if FLAGS.backend != KERAS:
+        model = HoneypotSklearn(FLAGS.backend)
+        model.build_model()
+        model.fit()
+        save_sklearn_model(model.model, model.encoder)
+        model.prepare_submission(FLAGS.backend)
+        return
+    if FLAGS.stream:
+        HoneypotStreamData.chunk_size = FLAGS.chunk_size
+        feature_encoder = encoder.FeatureEncoder.load(FLAGS.encoder) if FLAGS.encoder else None
+        model = HoneypotKerasStream(holdout=FLAGS.holdout, feature_encoder=feature_encoder)
+    else:
+        model = HoneypotKeras()
+    model.build_model()
+    model.fit(lr=0.01, epochs=1)
+    #model.fit(lr=0.001, epochs=10)
+    save_model(model.model, model.encoder)
+    model.prepare_submission('keras')
+
+
+if __name__ == '__main__':
+    flags.DEFINE_enum('backend', KERAS, (KERAS,) + sklearn_engine.BACKENDS, 'Model trained')
+    flags.DEFINE_bool('stream', False, 'Train Keras model reading the dataset in chunks instead of loading it in memory')
+    flags.DEFINE_integer('chunk_size', HoneypotStreamData.chunk_size, 'Rows read per chunk in stream mode')
+    flags.DEFINE_float('holdout', 0.05, 'Fraction of rows used for validation in stream mode')
+    flags.DEFINE_string('encoder', None, 'Pre-fitted encoder file used in stream mode, fitted on the dataset if not set')
+    app.run(main)
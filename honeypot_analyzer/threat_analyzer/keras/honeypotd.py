@@ -1,12 +1,28 @@
+import Queue
+import sys
+import threading
+import time
+
 import numpy as np
 
+from absl import flags
 from flask import Flask, jsonify, request
 
-from keras.models import model_from_json
+from honeypot_analyzer.threat_analyzer import numpy_engine
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_enum('engine', 'keras', ['keras', 'numpy'], 'Serve with Keras or the NumPy engine (no TensorFlow import)')
+flags.DEFINE_string('model_npz', numpy_engine.MODEL_NPZ, 'Weights exported by numpy_engine, used by numpy engine')
+
+flags.DEFINE_integer('max_batch_size', 64, 'Maximum number of callers evaluated in one model.predict call')
+flags.DEFINE_integer('max_wait_ms', 5, 'Maximum milliseconds a request waits for others to join its batch')
 
 # initialize our Flask application and the Keras model
 app = Flask(__name__)
 model = None
+graph = None
+batcher = None
 
 MODEL_NAME = 'honeypot.json'
 MODEL_WEIGHTS = 'honeypot.h5'
@@ -19,43 +35,168 @@ def load_model():
         substitute in your own networks just as easily)
     :return:
     """
-    global model
+    global model, graph
+    if FLAGS.engine == 'numpy':
+        model = numpy_engine.load(FLAGS.model_npz)
+        print('Loaded NumPy model from disk')
+        return
+
+    import tensorflow as tf
+    from keras.models import model_from_json
+
     json_file = open(MODEL_NAME, 'r')
     loaded_model_json = json_file.read()
     json_file.close()
     model = model_from_json(loaded_model_json)
     # Load weights into new model.
     model.load_weights(MODEL_WEIGHTS)
+    # Build predict function now, request threads share it afterwards.
+    model._make_predict_function()
+    graph = tf.get_default_graph()
     print('Loaded model from disk')
 
 
+def model_predict(data, batch_size=32):
+    """Runs model.predict from any thread."""
+    if graph is None:
+        return model.predict(data)
+    with graph.as_default():
+        return model.predict(data, batch_size=batch_size)
+
+
 def prepare_data(data):
-    """Build numpy array from Prediction."""
-    prediction = np.array([data])
-    print prediction.shape
-    return prediction
+    """Build numpy array from a list of callers."""
+    return np.array(data, dtype='float32')
+
+
+def feature_count():
+    """Number of features the loaded model expects per caller."""
+    if FLAGS.engine == 'numpy':
+        return model.feature_count
+    return model.input_shape[-1]
+
+
+def validate_caller(caller):
+    """Returns an error message if caller is not a list of feature_count numbers, else None.
+
+    Callers share a batch, one invalid caller would fail the others.
+    """
+    if not isinstance(caller, list) or len(caller) != feature_count():
+        return 'Caller must be a list of %d features' % feature_count()
+    if not all(isinstance(value, (int, long, float)) and not isinstance(value, bool) for value in caller):
+        return 'Caller features must be numbers'
+    return None
+
+
+def format_result(prediction):
+    """Returns threat and probability for a row of model.predict output."""
+    probability = float(prediction[1])
+    return {'threat': int(round(probability)), 'probability': probability}
+
+
+class _PendingPrediction(object):
+    def __init__(self, caller):
+        self.caller = caller
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class MicroBatcher(object):
+    """Coalesces concurrent single predictions into one model.predict call.
+
+    A batch is evaluated once it holds max_batch_size callers or its first
+    caller has waited max_wait_ms.
+    """
+
+    def __init__(self, predict_fn, max_batch_size, max_wait_ms):
+        self._predict_fn = predict_fn
+        self._max_batch_size = max_batch_size
+        self._max_wait = max_wait_ms / 1000.0
+        self._queue = Queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='micro-batcher')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def predict(self, caller):
+        """Blocks until caller prediction is available. Returns model.predict row."""
+        pending = _PendingPrediction(caller)
+        self._queue.put(pending)
+        pending.done.wait()
+        if pending.error:
+            raise pending.error
+        return pending.result
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.time() + self._max_wait
+        while len(batch) < self._max_batch_size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except Queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                predictions = self._predict_fn(prepare_data([pending.caller for pending in batch]), len(batch))
+                for pending, prediction in zip(batch, predictions):
+                    pending.result = prediction
+            except Exception as e:
+                for pending in batch:
+                    pending.error = e
+            finally:
+                for pending in batch:
+                    pending.done.set()
 
 
 @app.route('/predict', methods=['POST'])
 def predict():
-    # Initialize the data dictionary that will be returned from the view.
-    data = {"success": False}
-
     values = request.get_json()
     required = ['caller']
     if not all(k in values for k in required):
         return 'Missing values', 400
+    error = validate_caller(values['caller'])
+    if error:
+        return error, 400
 
-    prediction_data = prepare_data(values['caller'])
-    preds = model.predict(prediction_data)
-    result = np.around(preds[:, 1]).astype('int32')
-    response = {'results': 'Is a threat: %d Probability: %d' % result}
+    result = format_result(batcher.predict(values['caller']))
+    response = {'results': 'Is a threat: %d Probability: %f' % (result['threat'], result['probability'])}
     # return the data dictionary as a JSON response
     return jsonify(response), 200
 
 
+@app.route('/predict_batch', methods=['POST'])
+def predict_batch():
+    values = request.get_json()
+    required = ['callers']
+    if not all(k in values for k in required):
+        return 'Missing values', 400
+    if not values['callers']:
+        return 'Empty callers', 400
+    if not isinstance(values['callers'], list):
+        return 'Callers must be a list', 400
+    for caller in values['callers']:
+        error = validate_caller(caller)
+        if error:
+            return error, 400
+
+    # Already a batch, evaluate it directly in chunks of max_batch_size.
+    callers = prepare_data(values['callers'])
+    preds = model_predict(callers, batch_size=FLAGS.max_batch_size)
+    response = {'results': [format_result(prediction) for prediction in preds]}
+    return jsonify(response), 200
+
+
 if __name__ == "__main__":
-    print(("* Loading Keras model and Flask starting server..."
+    FLAGS(sys.argv)
+    print(("* Loading model and Flask starting server..."
            "please wait until server has fully started..."))
     load_model()
-    app.run()
+    batcher = MicroBatcher(model_predict, FLAGS.max_batch_size, FLAGS.max_wait_ms)
+    app.run(threaded=True)
@@ -0,0 +1,191 @@
+"""Pure NumPy inference engine for the honeypot Dense network.
+
+The model built by HoneypotKeras.build_model is a stack of Dense layers, with
+Dropout only active during training. Its weights are exported to a compact
+.npz file and evaluated here in float32 without importing Keras/TensorFlow.
+
+Export a trained model:
+
+    python -m honeypot_analyzer.threat_analyzer.numpy_engine \
+        --model_path=honeypot.json --model_weights=honeypot.h5 \
+        --output=honeypot.npz --quantization=float16
+"""
+
+import numpy as np
+
+from absl import app
+from absl import flags
+from absl import logging
+
+MODEL_NPZ = 'honeypot.npz'
+
+NONE = 'none'
+FLOAT16 = 'float16'
+INT8 = 'int8'
+QUANTIZATIONS = (NONE, FLOAT16, INT8)
+
+FLAGS = flags.FLAGS
+
+
+def _relu(x):
+    return np.maximum(x, 0, out=x)
+
+
+def _sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+def _softmax(x):
+    x = np.exp(x - x.max(axis=1, keepdims=True))
+    return x / x.sum(axis=1, keepdims=True)
+
+
+def _linear(x):
+    return x
+
+
+_ACTIVATIONS = {'relu': _relu, 'sigmoid': _sigmoid, 'softmax': _softmax, 'linear': _linear}
+
+
+class DenseEngine(object):
+    """Forward pass of a stack of Dense layers."""
+
+    def __init__(self, weights, activations):
+        """
+
+        :param weights: (list) Kernel and bias arrays for each Dense layer [W0, b0, W1, b1...].
+        :param activations: (list) Activation name for each Dense layer.
+        """
+        if len(weights) != 2 * len(activations):
+            raise ValueError('Expected kernel and bias for %d layers' % len(activations))
+        for activation in activations:
+            if activation not in _ACTIVATIONS:
+                raise ValueError('Unsupported activation: %s' % activation)
+        self._layers = [(np.ascontiguousarray(weights[i], dtype=np.float32),
+                         np.ascontiguousarray(weights[i + 1], dtype=np.float32),
+                         _ACTIVATIONS[activations[i // 2]]) for i in range(0, len(weights), 2)]
+        self.activations = list(activations)
+
+    @property
+    def feature_count(self):
+        return self._layers[0][0].shape[0]
+
+    def predict(self, features):
+        """Returns output probabilities, same as Keras model.predict.
+
+        :param features: A (batch, features) or (features,) array.
+        :return: A (batch, outputs) float32 numpy array.
+        """
+        x = np.asarray(features, dtype=np.float32)
+        if x.ndim == 1:
+            x = x[np.newaxis, :]
+        for kernel, bias, activation in self._layers:
+            x = np.dot(x, kernel)
+            x += bias
+            x = activation(x)
+        return x
+
+    def predict_labels(self, features):
+        """Returns int32 labels, rounding probability of class 1."""
+        return np.around(self.predict(features)[:, 1]).astype('int32')
+
+
+def _quantize(kernel, quantization):
+    """Returns arrays stored for kernel under quantization."""
+    if quantization == FLOAT16:
+        return {'kernel': kernel.astype(np.float16)}
+    if quantization == INT8:
+        # Symmetric, one scale per output unit.
+        scale = np.abs(kernel).max(axis=0) / 127.0
+        scale[scale == 0] = 1.0
+        return {'kernel': np.around(kernel / scale).astype(np.int8), 'scale': scale.astype(np.float32)}
+    return {'kernel': kernel.astype(np.float32)}
+
+
+def save(path, weights, activations, quantization=NONE):
+    """Writes weights to a compressed .npz file.
+
+    :param path: (str) Output file.
+    :param weights: (list) Kernel and bias arrays for each Dense layer.
+    :param activations: (list) Activation name for each Dense layer.
+    :param quantization: (str) One of QUANTIZATIONS. Applied to kernels only.
+    """
+    if quantization not in QUANTIZATIONS:
+        raise ValueError('Invalid quantization: %s' % quantization)
+    arrays = {'activations': np.array(activations), 'quantization': np.array(quantization)}
+    for layer in range(len(activations)):
+        for name, value in _quantize(np.asarray(weights[2 * layer]), quantization).iteritems():
+            arrays['%s_%d' % (name, layer)] = value
+        arrays['bias_%d' % layer] = np.asarray(weights[2 * layer + 1], dtype=np.float32)
+    np.savez_compressed(path, **arrays)
+    logging.info('Saved %d layers to %s (quantization: %s)' % (len(activations), path, quantization))
+
+
+def load(path):
+    """Returns a DenseEngine for weights written by save."""
+    npz = np.load(path)
+    activations = [str(activation) for activation in npz['activations']]
+    quantization = str(npz['quantization']) if 'quantization' in npz.files else NONE
+    weights = []
+    for layer in range(len(activations)):
+        kernel = npz['kernel_%d' % layer].astype(np.float32)
+        if quantization == INT8:
+            kernel *= npz['scale_%d' % layer]
+        weights.extend([kernel, npz['bias_%d' % layer]])
+    return DenseEngine(weights, activations)
+
+
+def keras_weights(model):
+    """Returns (weights, activations) of the Dense layers of a Keras model."""
+    layers = [layer for layer in model.layers if layer.get_weights()]
+    weights = []
+    for layer in layers:
+        weights.extend(layer.get_weights())
+    return weights, [layer.get_config()['activation'] for layer in layers]
+
+
+def read_keras_model(model_path, weights_path):
+    """Loads a model saved by honeypot_predictor.save_model."""
+    from keras.models import model_from_json
+
+    with open(model_path) as json_file:
+        model = model_from_json(json_file.read())
+    model.load_weights(weights_path)
+    return model
+
+
+def export(model, path=MODEL_NPZ, quantization=NONE, verify_features=None):
+    """Exports a Keras model and checks labels match on verify_features.
+
+    :param model: A Keras model.
+    :param path: (str) Output .npz file.
+    :param quantization: (str) One of QUANTIZATIONS.
+    :param verify_features: (numpy array) Optional encoded features to compare labels.
+    :return: (int) Number of mismatched labels, 0 if not verified.
+    """
+    weights, activations = keras_weights(model)
+    save(path, weights, activations, quantization)
+    if verify_features is None:
+        return 0
+    expected = np.around(model.predict(verify_features)[:, 1]).astype('int32')
+    mismatches = int((load(path).predict_labels(verify_features) != expected).sum())
+    if mismatches:
+        logging.warning('%d of %d labels differ from Keras model' % (mismatches, len(expected)))
+    else:
+        logging.info('All %d labels match Keras model' % len(expected))
+    return mismatches
+
+
+def main(_):
+    model = read_keras_model(FLAGS.model_path, FLAGS.model_weights)
+    verify_features = np.load(FLAGS.verify_features) if FLAGS.verify_features else None
+    export(model, FLAGS.output, FLAGS.quantization, verify_features)
+
+
+if __name__ == '__main__':
+    flags.DEFINE_string('model_path', 'honeypot.json', 'Keras model json file')
+    flags.DEFINE_string('model_weights', 'honeypot.h5', 'Keras HDF5 weights file')
+    flags.DEFINE_string('output', MODEL_NPZ, 'Output .npz file')
+    flags.DEFINE_enum('quantization', NONE, QUANTIZATIONS, 'Kernel storage precision')
+    flags.DEFINE_string('verify_features', None, '.npy file with encoded features used to compare labels')
+    app.run(main)
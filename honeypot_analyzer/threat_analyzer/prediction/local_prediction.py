@@ -0,0 +1,91 @@
+"""Performs threat predictions in process.
+
+Local alternative to threat_prediction which avoids one Google Prediction API
+round-trip per call. The model exported by honeypot_predictor.save_model
+(honeypot.json/honeypot.h5), or the .npz written by numpy_engine, is loaded once
+and evaluated with NumPy. scikit-learn models (.pkl, see sklearn_engine) are
+served the same way.
+"""
+
+from absl import app
+from absl import flags
+from absl import logging
+
+from honeypot_analyzer.threat_analyzer import encoder
+from honeypot_analyzer.threat_analyzer import numpy_engine
+from honeypot_analyzer.threat_analyzer import sklearn_engine
+
+MODEL_NAME = 'honeypot.json'
+MODEL_WEIGHTS = 'honeypot.h5'
+
+FLAGS = flags.FLAGS
+
+_model = None
+
+
+class LocalModel(object):
+    """Dense network evaluated with NumPy, or scikit-learn model."""
+
+    def __init__(self, engine, feature_encoder):
+        """
+
+        :param engine: A numpy_engine.DenseEngine or sklearn_engine.SklearnEngine.
+        :param feature_encoder: An encoder.FeatureEncoder fitted during training.
+        """
+        self._engine = engine
+        self._encoder = feature_encoder
+
+    def predict(self, row):
+        """Returns (label, probability) for a single Homer row."""
+        probability = float(self._engine.predict(self._encoder.vectorize(row))[0, 1])
+        return int(round(probability)), probability
+
+
+def load_model(model_path=MODEL_NAME, weights_path=MODEL_WEIGHTS, encoder_path=encoder.ENCODER_FILE):
+    """Loads model once. Must be called before predict.
+
+    :param model_path: (str) Keras model json file. Ignored for .npz and .pkl weights.
+    :param weights_path: (str) Keras HDF5, numpy_engine .npz or sklearn_engine .pkl file.
+    :param encoder_path: (str) FeatureEncoder saved by honeypot_predictor.save_model.
+    :return: A LocalModel.
+    """
+    global _model
+    if weights_path.endswith('.npz'):
+        engine = numpy_engine.load(weights_path)
+    elif weights_path.endswith('.pkl'):
+        engine = sklearn_engine.load(weights_path)
+    else:
+        weights, activations = numpy_engine.keras_weights(numpy_engine.read_keras_model(model_path, weights_path))
+        engine = numpy_engine.DenseEngine(weights, activations)
+    _model = LocalModel(engine, encoder.FeatureEncoder.load(encoder_path))
+    logging.info('Loaded local model from %s' % weights_path)
+    return _model
+
+
+def predict(individual_prediction):
+    """
+
+    :param individual_prediction: (list) List of values.
+    :return: (label, stats) as returned by threat_prediction.predict.
+    """
+    if _model is None:
+        raise ValueError('Model is not loaded')
+    label, probability = _model.predict(individual_prediction)
+    stats = [{'label': '1', 'score': '%f' % probability},
+             {'label': '0', 'score': '%f' % (1 - probability)}]
+    logging.info('Label: %s Stats: %s' % (label, stats))
+    return label, stats
+
+
+def main(_):
+    load_model(FLAGS.model_path, FLAGS.model_weights, FLAGS.encoder)
+    with open('predictions.csv') as f:
+        individual_prediction = f.readline().strip().split(',')
+    predict(individual_prediction[:len(encoder.HOMER_COLUMNS)])
+
+
+if __name__ == '__main__':
+    flags.DEFINE_string('model_path', MODEL_NAME, 'Keras model json file')
+    flags.DEFINE_string('model_weights', MODEL_WEIGHTS, 'Keras HDF5, NumPy .npz or scikit-learn .pkl weights file')
+    flags.DEFINE_string('encoder', encoder.ENCODER_FILE, 'Feature encoder saved during training')
+    app.run(main)
@@ -1,6 +1,7 @@
 """Launches predictions to Google API Prediction."""
 
 import os
+import threading
 
 from googleapiclient import discovery, errors
 from oauth2client.client import GoogleCredentials
@@ -23,6 +24,9 @@ PREDICTIONS_FILE = 'predictions.csv'
 
 FLAGS = flags.FLAGS
 
+# Discovery clients are not thread safe, keep one per prediction worker.
+_local = threading.local()
+
 
 def get_service():
     """Get Service from Google Cloud API"""
@@ -34,6 +38,13 @@ def get_service():
     return discovery.build('prediction', 'v1.6', credentials=credentials)
 
 
+def get_cached_service():
+    """Get Service from Google Cloud API, built only once per thread."""
+    if getattr(_local, 'service', None) is None:
+        _local.service = get_service()
+    return _local.service
+
+
 def insert_model():
     api = get_service()
     logging.info('Inserting Model into Google Prediction API')
@@ -70,7 +81,7 @@ def predict(individual_prediction):
     :return:
     """
     logging.info('Perform predictions for %r' % individual_prediction)
-    api = get_service()
+    api = get_cached_service()
     prediction = api.trainedmodels().predict(project=PROJECT_ID, id=MODEL_ID, body={
         'input': {
             'csvInstance': individual_prediction
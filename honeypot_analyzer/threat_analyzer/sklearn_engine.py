@@ -0,0 +1,81 @@
+"""scikit-learn backends for the honeypot classifier.
+
+Lighter alternatives to the HoneypotKeras network, trained from the same
+HoneypotData pipeline (see keras/honeypot_predictor.py --backend) and served
+by local_prediction from a pickled .pkl file. SklearnEngine has the same
+predict interface as numpy_engine.DenseEngine.
+"""
+
+import cPickle as pickle
+
+import numpy as np
+
+MODEL_PKL = 'honeypot.pkl'
+
+LOGISTIC = 'logistic'
+GRADIENT_BOOSTING = 'gradient_boosting'
+RANDOM_FOREST = 'random_forest'
+BACKENDS = (LOGISTIC, GRADIENT_BOOSTING, RANDOM_FOREST)
+
+
+def build(backend, random_state=606):
+    """Returns an untrained estimator.
+
+    :param backend: (str) One of BACKENDS.
+    :param random_state: (int) Seed.
+    """
+    # Only needed for training, serving unpickles the estimator.
+    from sklearn.ensemble import GradientBoostingClassifier
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import StandardScaler
+
+    if backend == LOGISTIC:
+        # Label codes and ports have very different ranges.
+        return make_pipeline(StandardScaler(),
+                             LogisticRegression(solver='liblinear', class_weight='balanced',
+                                                random_state=random_state))
+    if backend == GRADIENT_BOOSTING:
+        return GradientBoostingClassifier(n_estimators=100, max_depth=3, random_state=random_state)
+    if backend == RANDOM_FOREST:
+        return RandomForestClassifier(n_estimators=50, max_depth=12, class_weight='balanced', n_jobs=1,
+                                      random_state=random_state)
+    raise ValueError('Invalid backend: %s' % backend)
+
+
+class SklearnEngine(object):
+    """Fitted scikit-learn classifier with the numpy_engine.DenseEngine interface."""
+
+    def __init__(self, estimator):
+        self._estimator = estimator
+
+    @property
+    def estimator(self):
+        return self._estimator
+
+    def predict(self, features):
+        """Returns class probabilities.
+
+        :param features: A (batch, features) or (features,) array.
+        :return: A (batch, 2) numpy array.
+        """
+        x = np.asarray(features, dtype=np.float32)
+        if x.ndim == 1:
+            x = x[np.newaxis, :]
+        return self._estimator.predict_proba(x)
+
+    def predict_labels(self, features):
+        """Returns int32 labels, rounding probability of class 1."""
+        return np.around(self.predict(features)[:, 1]).astype('int32')
+
+
+def save(path, estimator):
+    with open(path, 'wb') as model_file:
+        pickle.dump(estimator, model_file, pickle.HIGHEST_PROTOCOL)
+
+
+def load(path):
+    """Returns a SklearnEngine for an estimator written by save."""
+    with open(path, 'rb') as model_file:
+        return SklearnEngine(pickle.load(model_file))
@@ -1,11 +1,152 @@
 # White list. This list is not propagated to network.
 
+import binascii
+import bisect
+import os
+import signal
+import socket
+import time
+
+from absl import logging
+
 WHITE_LIST = ['127.0.0.1',
-              '54.172.60.0',
-              '54.172.60.1',
-              '54.172.60.2',
-              '54.172.60.3',
-              '54.244.51.0',
-              '54.244.51.1',
-              '54.244.51.2',
-              '54.244.51.3']
+              '54.172.60.0/30',
+              '54.244.51.0/30']
+
+_FAMILIES = ((socket.AF_INET, 32), (socket.AF_INET6, 128))
+
+
+def _parse_address(address):
+    """Returns (family, bits, integer) of an IPv4 or IPv6 address. Raises ValueError."""
+    for family, bits in _FAMILIES:
+        try:
+            return family, bits, int(binascii.hexlify(socket.inet_pton(family, address)), 16)
+        except (socket.error, ValueError):
+            continue
+    raise ValueError('Invalid IP address: %s' % address)
+
+
+def parse_network(network):
+    """Returns (family, first, last) integer range of an address or CIDR.
+
+    :param network: (str) Like '54.172.60.0/30', '2001:db8::/32' or '127.0.0.1'.
+    """
+    address, _, prefix = network.strip().partition('/')
+    family, bits, value = _parse_address(address)
+    prefix = int(prefix) if prefix else bits
+    if not 0 <= prefix <= bits:
+        raise ValueError('Invalid prefix length: %s' % network)
+    host_mask = (1 << (bits - prefix)) - 1
+    first = value & ~host_mask
+    return family, first, first | host_mask
+
+
+class _Index(object):
+    """Sorted, merged, non overlapping ranges of one address family."""
+
+    def __init__(self, ranges):
+        merged = []
+        for first, last in sorted(ranges):
+            if merged and first <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], last)
+            else:
+                merged.append([first, last])
+        self.firsts = [first for first, _ in merged]
+        self.lasts = [last for _, last in merged]
+
+    def __contains__(self, value):
+        position = bisect.bisect_right(self.firsts, value) - 1
+        return position >= 0 and value <= self.lasts[position]
+
+
+class Whitelist(object):
+    """IPv4/IPv6 CIDR whitelist with O(log n) lookups.
+
+    Networks come from WHITE_LIST and, optionally, a file with one address or
+    CIDR per line ('#' starts a comment). The file is reloaded when its
+    modification time changes, checked at most every check_interval seconds,
+    or on SIGHUP once install_signal_handler was called.
+    """
+
+    def __init__(self, path=None, networks=None, check_interval=5):
+        """
+
+        :param path: (str) Whitelist file.
+        :param networks: (list) Networks always whitelisted. Defaults to WHITE_LIST.
+        :param check_interval: (float) Seconds between file modification checks.
+        """
+        self._path = path
+        self._networks = WHITE_LIST if networks is None else networks
+        self._check_interval = check_interval
+        self._checked = 0
+        self._mtime = None
+        self._reload_requested = False
+        self._indexes = {}
+        self.reload()
+
+    def __len__(self):
+        return sum(len(index.firsts) for index in self._indexes.values())
+
+    def _read(self):
+        with open(self._path) as whitelist_file:
+            for line in whitelist_file:
+                network = line.split('#', 1)[0].strip()
+                if network:
+                    yield network
+
+    def reload(self):
+        """Rebuilds index. Keeps previous one if the file can not be read."""
+        networks = list(self._networks)
+        if self._path:
+            try:
+                self._mtime = os.path.getmtime(self._path)
+                networks.extend(self._read())
+            except (IOError, OSError) as e:
+                logging.error('Unable to read whitelist %s: %s' % (self._path, e))
+                if self._indexes:
+                    return
+        ranges = {}
+        for network in networks:
+            try:
+                family, first, last = parse_network(network)
+            except ValueError as e:
+                logging.error('Ignoring whitelist entry: %s' % e)
+                continue
+            ranges.setdefault(family, []).append((first, last))
+        # Swap in one assignment, lookups from other threads see old or new index.
+        self._indexes = {family: _Index(family_ranges) for family, family_ranges in ranges.iteritems()}
+        logging.info('Loaded whitelist with %d networks' % len(networks))
+
+    def maybe_reload(self):
+        """Reloads if SIGHUP was received or the file changed."""
+        if self._reload_requested:
+            self._reload_requested = False
+            self.reload()
+            return
+        if not self._path or time.time() - self._checked < self._check_interval:
+            return
+        self._checked = time.time()
+        try:
+            mtime = os.path.getmtime(self._path)
+        except OSError:
+            return
+        if mtime != self._mtime:
+            self.reload()
+
+    def install_signal_handler(self):
+        """Reload on SIGHUP. Must be called from the main thread."""
+        signal.signal(signal.SIGHUP, self._handle_signal)
+
+    def _handle_signal(self, signum, frame):
+        self._reload_requested = True
+
+    def __contains__(self, address):
+        self.maybe_reload()
+        if not address:
+            return False
+        try:
+            family, _, value = _parse_address(address)
+        except ValueError:
+            return False
+        index = self._indexes.get(family)
+        return index is not None and value in index
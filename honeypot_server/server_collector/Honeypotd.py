@@ -7,20 +7,64 @@ from absl import flags
 from absl import logging
 
 from honeypot_analyzer.publisher_notifier import Call
+from honeypot_analyzer.threat_analyzer import encoder
+from honeypot_analyzer.threat_analyzer.prediction import local_prediction
 from honeypot_analyzer.threat_analyzer.prediction import threat_prediction
 from honeypot_server.conf import settings
 from honeypot_server.conf import whitelist
 
 from honeypot_server.call_control import Client
 from honeypot_server.call_control.Connection import ESLError
+from honeypot_server.server_collector import pipeline
+from honeypot_server.server_collector import retry
+from honeypot_server.server_collector import verdicts
+from honeypot_analyzer.publisher_notifier import BatchPublisher
+from honeypot_analyzer.publisher_notifier import Broker
 from honeypot_analyzer.publisher_notifier import Publisher
 
+from utils import lru_cache
 from utils import mysql_client
 
 FLAGS = flags.FLAGS
 
 flags.DEFINE_string('host', '127.0.0.1', 'Freeswitch ESL server')
 flags.DEFINE_integer('port', 8021, 'Freeswitch ESL port')
+flags.DEFINE_enum('prediction_backend', 'remote', ['remote', 'local'],
+                  'Google Prediction API (remote) or in process model (local)')
+flags.DEFINE_string('model_path', local_prediction.MODEL_NAME, 'Keras model json file used by local backend')
+flags.DEFINE_string('model_weights', local_prediction.MODEL_WEIGHTS,
+                    'Keras HDF5, NumPy .npz or scikit-learn .pkl weights file used by local backend')
+flags.DEFINE_string('encoder', encoder.ENCODER_FILE, 'Feature encoder saved during training, used by local backend')
+flags.DEFINE_integer('db_pool_min', 1, 'Homer MySQL connections opened at start')
+flags.DEFINE_integer('db_pool_max', 8, 'Maximum Homer MySQL connections')
+flags.DEFINE_integer('homer_tables_refresh', 300, 'Seconds between refreshes of the Homer table list')
+flags.DEFINE_integer('max_call_duration', 3600, 'Seconds a call may last, used to find the Homer table of its INVITE')
+flags.DEFINE_integer('call_cache_entries', 10000, 'Maximum number of cached Homer INVITE rows, 0 to disable')
+flags.DEFINE_integer('call_cache_bytes', 32 * 1024 * 1024, 'Maximum approximate bytes of cached Homer INVITE rows')
+flags.DEFINE_float('call_cache_ttl', 300, 'Seconds a cached Homer INVITE row is valid')
+flags.DEFINE_float('call_cache_negative_ttl', 1,
+                   'Seconds a call not found in Homer is cached, keep below --retry_initial_delay')
+flags.DEFINE_float('verdict_ttl', 3600, 'Seconds an IP flagged as threat skips lookup and scoring, 0 to disable')
+flags.DEFINE_float('notify_window', 60, 'Seconds between notifications for calls from the same threat IP')
+flags.DEFINE_integer('verdict_cache_entries', 100000, 'Maximum number of threat IPs remembered')
+flags.DEFINE_string('whitelist_file', None, 'File with whitelisted IPs/CIDRs, reloaded on change or SIGHUP')
+flags.DEFINE_enum('transport', Publisher.PUBNUB, Publisher.TRANSPORTS, 'Threat notification transport')
+flags.DEFINE_string('broker_address', Broker.DEFAULT_ADDRESS,
+                    "Notification broker address, 'host:port' or 'unix:/path', used by broker transport")
+flags.DEFINE_integer('publish_batch_size', 50, 'Maximum threat notifications per published message')
+flags.DEFINE_integer('publish_max_delay_ms', 1000, 'Milliseconds a threat notification waits for its batch')
+flags.DEFINE_integer('publish_max_retries', 5, 'Retries of a failed publish before dropping it')
+flags.DEFINE_integer('queue_size', 1000, 'Maximum number of hangup events waiting for prediction')
+flags.DEFINE_integer('workers', 4, 'Number of prediction worker threads')
+flags.DEFINE_integer('lookup_batch_size', 32, 'Maximum number of calls resolved by one Homer query')
+flags.DEFINE_integer('lookup_flush_ms', 50, 'Milliseconds a worker waits to fill a Homer lookup batch')
+flags.DEFINE_enum('backpressure', pipeline.BLOCK, pipeline.POLICIES, 'Policy applied when prediction queue is full')
+flags.DEFINE_string('spill_file', '/tmp/honeypotd_spill.jsonl', 'File used by the spill backpressure policy')
+flags.DEFINE_integer('retry_max_attempts', 5, 'Homer lookup attempts per call before giving up')
+flags.DEFINE_float('retry_initial_delay', 2.0, 'Seconds before retrying a call not found in Homer')
+flags.DEFINE_float('retry_max_delay', 60.0, 'Maximum seconds between Homer lookup retries')
+flags.DEFINE_integer('retry_max_pending', 10000, 'Maximum number of calls waiting for retry')
+flags.DEFINE_integer('stats_interval', 60, 'Seconds between pipeline latency reports')
 
 # Freeswitch ESL events to Monitor.
 EVENTS = ['BACKGROUND_JOB',
@@ -35,6 +79,9 @@ EVENTS = ['BACKGROUND_JOB',
 
 # Freeswitch variables.
 _CHANNEL_UUID = 'Channel-Call-UUID'
+_EVENT_TIMESTAMP = 'Event-Date-Timestamp'
+# Seconds between checks for coalesced notifications.
+_NOTIFY_INTERVAL = 1
 _SIP_CALL_ID = 'variable_sip_call_id'
 _SIP_TERM_STATUS = 'variable_sip_term_status'
 _SIP_INVITE_FAILURE_MSG = 'variable_sip_invite_failure_phrase'
@@ -46,21 +93,36 @@ _SIP_REMOTE_PORT = 'variable_sip_network_port'
 _SIP_FROM_STRIPPED = 'variable_sip_from_user_stripped'
 _SIP_FROM = 'variable_sip_full_from'
 
-DB_CLIENT = mysql_client.MySQLClient(username=settings.HOMER_DB_USER,
-                                     password=settings.HOMER_DB_PASSWORD,
-                                     host=settings.HOMER_DB_HOST,
-                                     port=settings.HOMER_DB_PORT,
-                                     database=settings.HOMER_DATABASE)
-
 
 class ESLHandler(object):
     """Listens for Event Socket Layer ESL signals from Freeswitch."""
 
-    def __init__(self, host, port, events):
+    def __init__(self, host, port, events, db_client, predictor=threat_prediction):
         self._host = host
         self._port = port
         self._events = events
-        self.pending_calls = []
+        self._db_client = db_client
+        self._tables = Call.TableResolver(db_client, FLAGS.homer_tables_refresh, FLAGS.max_call_duration)
+        # Without cache, module functions are used directly.
+        self._calls = Call
+        if FLAGS.call_cache_entries:
+            self._calls = Call.CachedCalls(lru_cache.LRUCache(max_entries=FLAGS.call_cache_entries,
+                                                              max_bytes=FLAGS.call_cache_bytes,
+                                                              ttl=FLAGS.call_cache_ttl,
+                                                              negative_ttl=FLAGS.call_cache_negative_ttl))
+        self._predictor = predictor
+        self._pnconfig = None
+        self._publisher = None
+        self._pipeline = None
+        self.counters = pipeline.LatencyCounters()
+        self.whitelist = whitelist.Whitelist(FLAGS.whitelist_file)
+        self.verdicts = verdicts.VerdictCache(ttl=FLAGS.verdict_ttl,
+                                              notify_window=FLAGS.notify_window,
+                                              max_entries=FLAGS.verdict_cache_entries)
+        self.pending_calls = retry.RetryScheduler(max_attempts=FLAGS.retry_max_attempts,
+                                                  initial_delay=FLAGS.retry_initial_delay,
+                                                  max_delay=FLAGS.retry_max_delay,
+                                                  max_pending=FLAGS.retry_max_pending)
 
     @property
     def host(self, host):
@@ -86,25 +148,16 @@ class ESLHandler(object):
     def events(self):
         return self._events
 
-    def predict(self, sip_call_id, sip_remote_ip_addr, sip_remote_port, pending):
-        """
+    def score(self, sip_remote_ip_addr, potential_threat):
+        """Ask Threat analyzer to predict if caller is an Attacker.
 
-        :param sip_call_id:
         :param sip_remote_ip_addr:
-        :param sip_remote_port:
-        :param pending:
-        :return:
+        :param potential_threat: Homer INVITE row.
+        :return: 1 if threat, 0 otherwise.
         """
-
-        caller = Call.Call(sip_call_id, sip_remote_ip_addr, int(sip_remote_port))
-        potential_threat = caller.GetCallInfo(DB_CLIENT)
-        if not potential_threat:
-            logging.error('Call with callid: %s was not found in Database' % sip_call_id)
-            return -1
-
-        # Ask Threat analyzer to predict if caller is an Attacker.
         potential_threat = [str(call) if call else '' for call in potential_threat]
-        label, stats = threat_prediction.predict(potential_threat)
+        with self.counters.timer(pipeline.STAGE_PREDICT):
+            label, stats = self._predictor.predict(potential_threat)
         if label == 1:
             logging.warning('Threat detected %s . Remote SIP host: %s ' % (stats, sip_remote_ip_addr))
             return 1
@@ -112,6 +165,57 @@ class ESLHandler(object):
             logging.info('No threat %s' % stats)
             return 0
 
+    def process(self, records):
+        """Runs in a prediction worker. Predicts and notifies completed calls.
+
+        :param records: (list) pipeline.HangupRecord, looked up in Homer with one query.
+        :return:
+        """
+        # Connect to Homer and get Caller information.
+        callers = [Call.Call(record.sip_call_id, record.sip_remote_ip_addr, int(record.sip_remote_port),
+                             record.event_timestamp) for record in records]
+        try:
+            with self.counters.timer(pipeline.STAGE_LOOKUP):
+                calls_info = self._calls.GetCallsInfo(self._db_client, callers, self._tables)
+        except Exception as e:
+            # Pool exhausted, failover or missing table, retry the whole batch later.
+            logging.error('Unable to look up %d calls in Database: %s' % (len(records), e))
+            for record in records:
+                self.pending_calls.schedule(record)
+            return
+        for record in records:
+            potential_threat = calls_info.get(record.sip_call_id)
+            if not potential_threat:
+                logging.error('Call with callid: %s was not found in Database' % record.sip_call_id)
+                logging.info('Adding call to Queue')
+                self.pending_calls.schedule(record)
+            elif self.score(record.sip_remote_ip_addr, potential_threat) == 1:
+                # Other workers may have flagged this IP meanwhile.
+                if self.verdicts.add_threat(record.sip_remote_ip_addr, record):
+                    self.notify(record)
+
+    def notify(self, record, count=1):
+        """Notify Network via configured transport.
+
+        :param record: A pipeline.HangupRecord.
+        :param count: (int) Calls from the same IP this notification stands for.
+        :return:
+        """
+        call_info = {"Honeypot": self._pnconfig.uuid,
+                     "RemoteIpv4": record.sip_remote_ip_addr,
+                     "SipProtocol": record.sip_protocol,
+                     "SipRemotePort": record.sip_remote_port,
+                     "SipFrom": record.sip_from,
+                     "SipFromStripped": record.sip_from_stripped,
+                     "SipTo": record.sip_to_user,
+                     "RequestUri": record.sip_req_uri,
+                     "SipCallid": record.sip_call_id,
+                     "Calls": count
+                     }
+        logging.info('Notifying Subscribers: Call info: %s' % call_info)
+        # Sent in batches by BatchPublisher thread.
+        self._publisher.publish(call_info)
+
     def listen(self):
         """
 
@@ -119,13 +223,30 @@ class ESLHandler(object):
         """
         try:
             logging.info('Initializing Publisher...')
-            # Generate notifications to clients that subscribe service via PubNub (pubnub.com).
+            # Generate notifications to clients that subscribe service via PubNub (pubnub.com) or a local
+            # Broker. Honeypot identity comes from PubNub configuration in both cases.
 
-            pnconfig = Publisher.GetConfig()
-            if not isinstance(pnconfig, Publisher.PNConfiguration):
+            self._pnconfig = Publisher.GetConfig()
+            if not isinstance(self._pnconfig, Publisher.PNConfiguration):
                 raise ValueError('Invalid PubNub configuration')
 
-            pubnub = Publisher.Publisher(pnconfig)
+            transport = Publisher.GetTransport(FLAGS.transport, self._pnconfig, FLAGS.broker_address)
+            self._publisher = BatchPublisher.BatchPublisher(transport,
+                                                            Publisher.CHANNEL,
+                                                            max_batch_size=FLAGS.publish_batch_size,
+                                                            max_delay=FLAGS.publish_max_delay_ms / 1000.0,
+                                                            max_retries=FLAGS.publish_max_retries,
+                                                            counters=self.counters)
+            self._publisher.start()
+
+            logging.info('Initializing prediction workers...')
+            work_queue = pipeline.WorkQueue(FLAGS.queue_size, FLAGS.backpressure, FLAGS.spill_file)
+            self._pipeline = pipeline.PredictionPipeline(self.process, work_queue, FLAGS.workers, self.counters,
+                                                         batch_size=FLAGS.lookup_batch_size,
+                                                         flush_window=FLAGS.lookup_flush_ms / 1000.0)
+            self._pipeline.start()
+
+            self.whitelist.install_signal_handler()
 
             logging.info('Listener starting...')
             if not self.host:
@@ -145,6 +266,8 @@ class ESLHandler(object):
             connection.events('plain', self.events)
             time.sleep(0.05)
             stay_connected = True
+            last_report = time.time()
+            last_notify = time.time()
 
             while stay_connected:
                 reply = connection.recvEventTimed(1000)
@@ -166,12 +289,6 @@ class ESLHandler(object):
                         sip_invite_failure_phrase = reply.getHeader(_SIP_INVITE_FAILURE_MSG)
                         # Collect SIP call details.
                         sip_remote_ip_addr = reply.getHeader(_SIP_NETWORK_IP)
-                        sip_remote_port = reply.getHeader(_SIP_REMOTE_PORT)
-                        sip_protocol = reply.getHeader(_SIP_PROTOCOL)
-                        sip_from_stripped = reply.getHeader(_SIP_FROM_STRIPPED)
-                        sip_from = reply.getHeader(_SIP_FROM)
-                        sip_to_user = reply.getHeader(_SIP_TO_USER)
-                        sip_req_uri = reply.getHeader(_SIP_REQUEST_URI)
 
                         logging.warning('Call ended UUID: %s Reason: %s' % (uuid, hangup_cause))
                         if sip_term_status:
@@ -179,51 +296,86 @@ class ESLHandler(object):
                                 logging.error('SIP Error. Call ended %s %s %s %s' % (uuid,
                                                                                      sip_call_id, sip_term_status,
                                                                                      sip_invite_failure_phrase))
-                        logging.info('Send event to Threat Analyzer...')
-
-                        # Use PubSub notification systems.
-                        if sip_remote_ip_addr not in whitelist.WHITE_LIST:
-                            # Connect to Homer and get Caller information.
-                            threat = self.predict(sip_call_id, sip_remote_ip_addr, int(sip_remote_port), False)
-                            if threat == 1:
-                                call_info = {"Honeypot": pnconfig.uuid,
-                                             "RemoteIpv4": sip_remote_ip_addr,
-                                             "SipProtocol": sip_protocol,
-                                             "SipRemotePort": sip_remote_port,
-                                             "SipFrom": sip_from,
-                                             "SipFromStripped": sip_from_stripped,
-                                             "SipTo": sip_to_user,
-                                             "RequestUri": sip_req_uri,
-                                             "SipCallid": sip_call_id
-                                             }
-                                logging.info('Notifying Subscribers: Call info: %s' % call_info)
-                                # Notify Network via PubNub.
-                                try:
-                                    pubnub.publish(Publisher.CHANNEL, call_info)
-                                except ValueError as e:
-                                    logging.exception(e)
-                            elif threat == -1:
-                                logging.info('Adding call to Queue')
-                                self.pending_calls.append((sip_call_id, sip_remote_ip_addr, int(sip_remote_port)))
-                                continue
-                        else:
+
+                        # Microseconds since epoch.
+                        event_timestamp = reply.getHeader(_EVENT_TIMESTAMP)
+                        record = pipeline.HangupRecord(uuid=uuid,
+                                                       sip_call_id=sip_call_id,
+                                                       sip_remote_ip_addr=sip_remote_ip_addr,
+                                                       sip_remote_port=reply.getHeader(_SIP_REMOTE_PORT),
+                                                       sip_protocol=reply.getHeader(_SIP_PROTOCOL),
+                                                       sip_from=reply.getHeader(_SIP_FROM),
+                                                       sip_from_stripped=reply.getHeader(_SIP_FROM_STRIPPED),
+                                                       sip_to_user=reply.getHeader(_SIP_TO_USER),
+                                                       sip_req_uri=reply.getHeader(_SIP_REQUEST_URI),
+                                                       event_timestamp=float(event_timestamp) / 1e6 if event_timestamp
+                                                       else time.time(),
+                                                       received=time.time(),
+                                                       attempts=0)
+
+                        if sip_remote_ip_addr in self.whitelist:
                             logging.warning(
                                 'Detected IP Address in Whitelist: %s. No notification was sent.' % sip_remote_ip_addr)
+                        elif self.verdicts.hit(sip_remote_ip_addr, record):
+                            logging.info('Known threat: %s. Notification coalesced.' % sip_remote_ip_addr)
+                        else:
+                            logging.info('Send event to Threat Analyzer...')
+                            self._pipeline.submit(record)
 
                 else:
                     logging.info('Listening...')
+                    if self._pipeline.queue.qsize() > 1:
+                        logging.warning('%d Calls waiting for prediction' % self._pipeline.queue.qsize())
                     if len(self.pending_calls) > 1:
                         logging.warning('%d Calls in Queue' % len(self.pending_calls))
-                    #TODO Process asyncronously (Celery/RabbitMQ)
+
+                # Resubmit calls whose Homer lookup is due for another attempt.
+                for record in self.pending_calls.pop_due():
+                    self._pipeline.submit(record._replace(received=time.time()))
+
+                # One notification per threat IP per window, with the number of calls.
+                if time.time() - last_notify >= _NOTIFY_INTERVAL:
+                    for record, count in self.verdicts.due_notifications():
+                        self.notify(record, count)
+                    last_notify = time.time()
+
+                if time.time() - last_report >= FLAGS.stats_interval:
+                    self.counters.report()
+                    if self._pipeline.queue.dropped:
+                        logging.warning('Calls dropped by backpressure: %d' % self._pipeline.queue.dropped)
+                    if FLAGS.call_cache_entries:
+                        logging.info('Homer cache: %s' % self._calls.cache.stats())
+                    logging.info('Threat verdicts: %s' % self.verdicts.stats())
+                    logging.info('Publisher: %s' % self._publisher.stats())
+                    logging.info('Retries deduped: %d expired: %d overflow: %d' % (self.pending_calls.deduped,
+                                                                                   self.pending_calls.expired,
+                                                                                   self.pending_calls.overflow))
+                    last_report = time.time()
 
         except KeyboardInterrupt:
             logging.warning('Exiting manually...')
-            logging.info('Pending calls to process: %d' % self.pending_calls)
+            if self._pipeline:
+                self._pipeline.stop()
+            if self._publisher:
+                self._publisher.stop()
+            logging.info('Pending calls to process: %d' % len(self.pending_calls))
+            self.counters.report()
 
 
 def main(_):
+    predictor = threat_prediction
+    if FLAGS.prediction_backend == 'local':
+        local_prediction.load_model(FLAGS.model_path, FLAGS.model_weights, FLAGS.encoder)
+        predictor = local_prediction
+    db_client = mysql_client.MySQLClient(username=settings.HOMER_DB_USER,
+                                         password=settings.HOMER_DB_PASSWORD,
+                                         host=settings.HOMER_DB_HOST,
+                                         port=settings.HOMER_DB_PORT,
+                                         database=settings.HOMER_DATABASE,
+                                         min_size=FLAGS.db_pool_min,
+                                         max_size=FLAGS.db_pool_max)
     # Connect to Freeswitch.
-    listener_instance = ESLHandler(settings.FREESWITCH_HOST, FLAGS.port, ' '.join(EVENTS))
+    listener_instance = ESLHandler(settings.FREESWITCH_HOST, FLAGS.port, ' '.join(EVENTS), db_client, predictor)
     listener_instance.listen()
 
 
@@ -0,0 +1,156 @@
+"""Build the threat_analyzer training dataset from freeswitch.log SIP traces.
+
+Every inbound INVITE becomes one row with the columns Call.GetCallInfo reads
+from Homer (encoder.HOMER_COLUMNS), so datasets can be rebuilt from traces
+without querying Homer. Files, and shards of large files, are parsed in a
+process pool; rows are written as each shard completes.
+
+Usage:
+    PYTHONPATH=../../.. python feature_extractor.py --processes=0 --output=honeypot_dataset.csv --label=1 freeswitch.log*
+"""
+
+import csv
+import multiprocessing
+import re
+
+from absl import app
+from absl import flags
+from absl import logging
+
+import trace_analyzer
+
+from honeypot_analyzer.threat_analyzer import encoder
+
+FLAGS = flags.FLAGS
+
+LABEL = 'toll_fraud'
+DESTINATION_PORT = 5060
+
+flags.DEFINE_string('output', None, 'Dataset CSV file')
+flags.DEFINE_integer('label', None, 'Value of the %s column, omitted when not set' % LABEL)
+flags.DEFINE_integer('destination_port', DESTINATION_PORT, 'Honeypot SIP port, not present in traces')
+
+# sip:user@host:port;params, user, port and params are optional.
+_SIP_URI = re.compile(r'sips?:(?:([^@;>]*)@)?([^:;>?\s]+)(?::(\d+))?')
+_TAG = re.compile(r';\s*tag=([^;>\s]+)')
+
+
+def parseUri(value):
+    """
+    :param value: Header value or Request-URI containing a SIP URI.
+    :return: (uri, user, host, port) or Nones.
+    """
+    uri = _SIP_URI.search(value or '')
+    if not uri:
+        return None, None, None, None
+    return uri.group(0), uri.group(1), uri.group(2), int(uri.group(3)) if uri.group(3) else None
+
+
+def isInboundInvite(sipMsg):
+    if not sipMsg.sipMsgMethodInfo.startswith('INVITE '):
+        return False
+    # Without a trace line the direction, and the source of the row, is unknown.
+    return sipMsg.sipTransport is not None and sipMsg.sipTransport[0] == 'recv'
+
+
+def inviteRow(sipMsg, destinationPort=DESTINATION_PORT):
+    """
+    :param sipMsg: trace_analyzer.sipMessage of an INVITE.
+    :param destinationPort: (int)
+    :return: dict with encoder.HOMER_COLUMNS.
+    """
+    ruri, ruriUser, ruriDomain, _ = parseUri(sipMsg.sipMsgMethodInfo)
+    fromHeader = sipMsg.getHeader('from') or ''
+    _, fromUser, fromDomain, _ = parseUri(fromHeader)
+    fromTag = _TAG.search(fromHeader)
+    _, toUser, _, _ = parseUri(sipMsg.getHeader('to'))
+    _, contactUser, contactIp, contactPort = parseUri(sipMsg.getHeader('contact'))
+    sourceIp = sourcePort = None
+    if sipMsg.sipTransport:
+        _, _, sourceIp, sourcePort = sipMsg.sipTransport
+    return {'ruri': ruri,
+            'ruri_user': ruriUser,
+            'ruri_domain': ruriDomain,
+            'from_user': fromUser,
+            'from_domain': fromDomain,
+            'from_tag': fromTag.group(1) if fromTag else None,
+            'to_user': toUser,
+            'contact_user': contactUser,
+            'callid': sipMsg.sipCallId,
+            'content_type': sipMsg.getHeader('content-type'),
+            'user_agent': sipMsg.getHeader('user-agent'),
+            'source_ip': sourceIp,
+            'source_port': sourcePort,
+            'destination_port': destinationPort,
+            'contact_ip': contactIp,
+            # Default SIP port when Contact has none.
+            'contact_port': contactPort or 5060}
+
+
+def extractShard(args):
+    """
+    Map step, rows of the first INVITE of every call in a shard.
+    :param args: (shard, destinationPort), see trace_analyzer.shardFile.
+    :return: List of rows.
+    """
+    shard, destinationPort = args
+    rows = list()
+    seen = set()
+    for sipMsg in trace_analyzer.parseSipMessages(trace_analyzer.readShard(*shard)):
+        # Retransmissions and re-INVITEs share the Call-ID.
+        if isInboundInvite(sipMsg) and sipMsg.sipCallId not in seen:
+            seen.add(sipMsg.sipCallId)
+            rows.append(inviteRow(sipMsg, destinationPort))
+    return rows
+
+
+def extract(filenames, output, label=None, processes=None, shardSize=trace_analyzer.SHARD_SIZE,
+            destinationPort=DESTINATION_PORT):
+    """
+    Write dataset CSV with a row per call in filenames.
+    :param filenames: Plain or gzip log files.
+    :param output: (str) CSV file.
+    :param label: (int) Value of LABEL column, omitted if None.
+    :param processes: (int) Worker processes, defaults to number of CPUs.
+    :param shardSize: (int) Bytes per shard.
+    :param destinationPort: (int)
+    :return: (int) Rows written.
+    """
+    columns = list(encoder.HOMER_COLUMNS)
+    if label is not None:
+        columns.append(LABEL)
+    shards = [(shard, destinationPort)
+              for filename in filenames for shard in trace_analyzer.shardFile(filename, shardSize)]
+    seen = set()
+    count = 0
+    pool = multiprocessing.Pool(processes)
+    try:
+        with open(output, 'wb') as f:
+            writer = csv.DictWriter(f, columns, extrasaction='ignore')
+            writer.writeheader()
+            for rows in pool.imap(extractShard, shards):
+                for row in rows:
+                    if row['callid'] in seen:
+                        continue
+                    seen.add(row['callid'])
+                    if label is not None:
+                        row[LABEL] = label
+                    writer.writerow(row)
+                    count += 1
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+    logging.info('Wrote %d rows to %s' % (count, output))
+    return count
+
+
+def main(argv):
+    if len(argv) < 2 or not FLAGS.output:
+        raise ValueError('Invalid file or output')
+    extract(argv[1:], FLAGS.output, FLAGS.label, FLAGS.processes or None, FLAGS.shard_size * 1024 * 1024,
+            FLAGS.destination_port)
+
+
+if __name__ == "__main__":
+    app.run(main)
@@ -6,25 +6,91 @@ Verify the following debug information is configured:
     fsctl loglevel 3
     sofia tracelevel 3
     sofia profile external siptrace on
+
+Usage:
+    python trace_analyzer.py freeswitch.log
+    python trace_analyzer.py --follow /usr/local/freeswitch/log/freeswitch.log
+    python trace_analyzer.py --processes=0 freeswitch.log.*.gz freeswitch.log
 """
 
+import collections
+import gzip
+import io
+import json
+import multiprocessing
+import os
 import re
+import string
 import sys
+import time
+
+from absl import app
+from absl import flags
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_bool('follow', False, 'Follow file as it grows and print call records as JSON lines')
+flags.DEFINE_bool('from_start', False, 'In follow mode, read existing content first')
+flags.DEFINE_float('idle_timeout', 60, 'In follow mode, seconds without messages after which a call is complete')
+flags.DEFINE_float('poll_interval', 0.5, 'In follow mode, seconds between checks for new lines')
+flags.DEFINE_integer('processes', 1, 'Worker processes parsing files and shards, 0 for one per CPU')
+flags.DEFINE_integer('shard_size', 64, 'Megabytes of a plain log file parsed by one worker')
+
+
+# Raw header name -> (interned name, interned lower case name without ':').
+_HEADER_NAMES = dict()
+_MAX_HEADER_NAMES = 4096
+_SIP_URI = re.compile(r'\<sip:(\+?\w+)@.*')
+
 
+def headerName(header):
+    """
+    Header names are shared by all messages, attacker crafted names are not cached past _MAX_HEADER_NAMES.
+    :param header: Header name as found in trace, like 'Call-ID:'.
+    :return: (interned header, interned lower case key without ':').
+    """
+    names = _HEADER_NAMES.get(header)
+    if names is None:
+        names = (intern(header), intern(header.rstrip(':').strip().lower()))
+        if len(_HEADER_NAMES) < _MAX_HEADER_NAMES:
+            _HEADER_NAMES[header] = names
+    return names
 
-class sipMessage():
+
+class sipMessage(object):
     """Create a SIP Message Object"""
 
+    __slots__ = ('_sipMsgMethodInfo', '_sipHeaderInfo', '_headerIndex', '_sipMsgSdpInfo', '_sipUuid',
+                 '_sipCampaign', '_sipCallId', '_sipUri', 'sipMsgCallId', 'sipTimestamp', 'sipTransport')
+
     def __init__(self):
         self._sipMsgMethodInfo = None
         self._sipHeaderInfo = list()
-        self._sipMsgSdpInfo = list()
+        # Lower case header name -> value of its last occurrence.
+        self._headerIndex = dict()
+        # Allocated for messages with SDP only.
+        self._sipMsgSdpInfo = None
         self._sipUuid = None
         self._sipCampaign = None
         self._sipCallId = None
         self._sipUri = None
-        self.hasSDP = False
         self.sipMsgCallId = ''
+        # Time of the last log line before the message, 'YYYY-MM-DD HH:MM:SS.ffffff'.
+        self.sipTimestamp = None
+        # (direction, protocol, remote ip, remote port) from the 'recv ... bytes from' line, e.g.
+        # ('recv', 'udp', '1.2.3.4', 5060).
+        self.sipTransport = None
+
+    def __getstate__(self):
+        return tuple(getattr(self, slot) for slot in self.__slots__)
+
+    def __setstate__(self, state):
+        for slot, value in zip(self.__slots__, state):
+            setattr(self, slot, value)
+
+    @property
+    def hasSDP(self):
+        return self._sipMsgSdpInfo is not None
 
     @property
     def sipUri(self):
@@ -56,7 +122,7 @@ class sipMessage():
 
     @sipCampaign.setter
     def sipCampaign(self, campaign):
-        self.sipCampaign = campaign
+        self._sipCampaign = campaign
 
     @property
     def sipMsgMethodInfo(self):
@@ -85,7 +151,7 @@ class sipMessage():
         :param header:
         :return:
         """
-        sip_uri = re.search(r'\<sip:(\+?\w+)@.*', header)
+        sip_uri = _SIP_URI.search(header)
         if sip_uri:
             self.sipUri = sip_uri.group(1)
 
@@ -96,7 +162,10 @@ class sipMessage():
         :param headerInfo:
         :return:
         """
-        self._sipHeaderInfo = headerInfo
+        self._sipHeaderInfo = list()
+        self._headerIndex = dict()
+        for header, value in headerInfo:
+            self.addSipHeader(header, value)
 
     def addSipHeader(self, header, value):
         """
@@ -108,7 +177,28 @@ class sipMessage():
         if "Call-ID:" in header:
             self.sipCallId = value
 
-        self.sipHeaderInfo.append((header, value))
+        header, key = headerName(header)
+        self._headerIndex[key] = value
+        self._sipHeaderInfo.append((header, value))
+
+    def getHeader(self, name, default=None):
+        """
+        O(1) case insensitive header lookup.
+        :param name: Header name with or without ':', e.g. 'call-id'.
+        :param default:
+        :return: Value of last header with name.
+        """
+        return self._headerIndex.get(name.rstrip(':').lower(), default)
+
+    def getHeaders(self, name):
+        """
+        :param name: Header name with or without ':'.
+        :return: List of values of all headers with name, in order.
+        """
+        key = name.rstrip(':').lower()
+        if key not in self._headerIndex:
+            return list()
+        return [value for header, value in self._sipHeaderInfo if headerName(header)[1] == key]
 
     def addSdpInfo(self, sdpLineNumber, sdpKey, sdpValue):
         """
@@ -118,7 +208,8 @@ class sipMessage():
         :param sdpValue:
         :return:
         """
-        self.hasSDP = True
+        if self._sipMsgSdpInfo is None:
+            self._sipMsgSdpInfo = list()
         sdpLine = sdpKey + '=' + sdpValue
         self._sipMsgSdpInfo.append(sdpLine)
 
@@ -141,31 +232,73 @@ class sipMessage():
                 print sdpLine
 
 
-def readFile(filename):
-    """
+SEPARATOR = '------------------------------------------------------------------------'
+# Calls not seen in this many messages are considered complete by streamSipCalls.
+MAX_IDLE_MESSAGES = 10000
+# Calls not seen in this many seconds are considered complete by followSipCalls.
+IDLE_TIMEOUT = 60
+# Yielded by followFile when no new line was available.
+IDLE = object()
+SHARD_SIZE = 64 * 1024 * 1024
+# Bytes before a shard searched for the timestamp and transport of its first message.
+SHARD_CONTEXT_SIZE = 64 * 1024
 
-    :param filename:
-    :return:
-    """
-    sipMessages = list()
-    with open(filename) as f:
-        for line in f:
-            sipLine = line.rstrip('\n')
-            sipLine = sipLine.strip()
-            sdpLine = 1
-            Message = re.search(r'(\w+\s+sip:.*)|(^SIP/2.0\s.*)', sipLine)
-            Header = re.search(r'(^\w+:) (.*)|([A-Za-z]+-[A-Za-z]+:) (.*)', sipLine)
-            SDP = re.search(r'(^[A-Za-z]){1}=(.*)', sipLine)
-            if sipLine == '------------------------------------------------------------------------':
-                sipMessageObject = None
+_MESSAGE = re.compile(r'(\w+\s+sip:.*)|(^SIP/2.0\s.*)')
+_HEADER = re.compile(r'(^\w+:) (.*)|([A-Za-z]+-[A-Za-z]+:) (.*)')
+_SDP_KEYS = frozenset(string.ascii_letters)
+_TIMESTAMP = re.compile(r'\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}(\.\d+)?')
+_TRANSPORT = re.compile(r'(recv|send) \d+ bytes (?:from|to) (\w+)/\[([^\]]+)\]:(\d+)')
 
+
+def parseSipMessages(lines):
+    """
+    Parse SIP messages from freeswitch.log lines. Each message is yielded once complete,
+    so memory use does not depend on the number of lines.
+    :param lines: Iterable of log lines. IDLE items are yielded back as they are, see followFile.
+    :return: Generator of sipMessage.
+    """
+    sipMessageObject = None
+    timestamp = None
+    transport = None
+    for line in lines:
+        if line is IDLE:
+            yield IDLE
+            continue
+        sipLine = line.strip()
+        if not sipLine:
+            continue
+        if sipLine == SEPARATOR:
+            if sipMessageObject:
+                yield sipMessageObject
+            sipMessageObject = None
+            continue
+
+        # Cheap substring checks first, most log lines are not part of a SIP message.
+        if 'sip:' in sipLine or sipLine.startswith('SIP/2.0'):
+            Message = _MESSAGE.search(sipLine)
             if Message:
+                if sipMessageObject:
+                    yield sipMessageObject
                 sipMessageObject = sipMessage()
-                sipMessages.append(sipMessageObject)
-                message = Message.group(0)
-                sipMessageObject.sipMsgMethodInfo = message
-                Message = None
-
+                sipMessageObject.sipMsgMethodInfo = Message.group(0)
+                sipMessageObject.sipTimestamp = timestamp
+                sipMessageObject.sipTransport = transport
+                transport = None
+
+        # Lines outside of a message are not SIP, but log lines carry the time and trace lines the peer.
+        if sipMessageObject is None:
+            if sipLine[4:5] == '-':
+                Timestamp = _TIMESTAMP.match(sipLine)
+                if Timestamp:
+                    timestamp = Timestamp.group(0)
+            elif sipLine[:5] in ('recv ', 'send '):
+                Transport = _TRANSPORT.match(sipLine)
+                if Transport:
+                    transport = (Transport.group(1), Transport.group(2), Transport.group(3), int(Transport.group(4)))
+            continue
+
+        if ': ' in sipLine:
+            Header = _HEADER.search(sipLine)
             if Header:
                 headerKey = Header.group(1)
                 headerValue = Header.group(2)
@@ -173,23 +306,131 @@ def readFile(filename):
                     headerKey = Header.group(3)
                     headerValue = Header.group(4)
                 sipMessageObject.addSipHeader(headerKey, headerValue)
-                if "INVITE" in message:
+                if "INVITE" in sipMessageObject.sipMsgMethodInfo:
                     if "To:" in headerKey:
                         sipMessageObject.setUri(headerValue)
                     if "X-UUID:" in headerKey:
                         sipMessageObject.sipUuid = headerValue
                     if "X-Campaign:" in headerKey:
                         sipMessageObject.sipCampaign = headerValue
-                Header = None
 
-            if SDP:
-                sdpKey = SDP.group(1)
-                sdpValue = SDP.group(2)
-                sipMessageObject.addSdpInfo(sdpLine, sdpKey, sdpValue)
-                sdpLine = + 1
-                SDP = None
+        if len(sipLine) > 1 and sipLine[1] == '=' and sipLine[0] in _SDP_KEYS:
+            sipMessageObject.addSdpInfo(None, sipLine[0], sipLine[2:])
+
+    if sipMessageObject:
+        yield sipMessageObject
+
+
+def readFile(filename):
+    """
+
+    :param filename: Plain or gzip (.gz) log file.
+    :return: Generator of sipMessage, in the order they appear in filename.
+    """
+    with openLog(filename) as f:
+        for sipMsg in parseSipMessages(f):
+            yield sipMsg
+
+
+def openLog(filename):
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'rb')
+    return io.open(filename, 'rb')
+
 
-    return sipMessages
+def shardFile(filename, shardSize=SHARD_SIZE):
+    """
+    Split filename in byte ranges of about shardSize. Gzip files are a single shard.
+    :param filename:
+    :param shardSize: (int) Bytes per shard.
+    :return: List of (filename, start, end), end is None for the end of file.
+    """
+    size = os.path.getsize(filename)
+    if filename.endswith('.gz') or size <= shardSize:
+        return [(filename, 0, None)]
+    starts = range(0, size, shardSize)
+    return [(filename, start, end) for start, end in zip(starts, starts[1:] + [None])]
+
+
+def readShard(filename, start=0, end=None):
+    """
+    Yield lines of filename shard. A shard starts at the first SEPARATOR line at or after start
+    and ends before the first SEPARATOR line at or after end, so a message is parsed by exactly one
+    of consecutive shards. The log and trace lines preceding that SEPARATOR belong to the previous
+    shard, the last ones within SHARD_CONTEXT_SIZE bytes before start are yielded first so the
+    first message keeps its sipTimestamp and sipTransport.
+    :param filename:
+    :param start: (int) Byte offset.
+    :param end: (int) Byte offset or None.
+    :return:
+    """
+    with openLog(filename) as f:
+        offset = 0
+        if start:
+            offset = max(start - SHARD_CONTEXT_SIZE, 1)
+            f.seek(offset - 1)
+            # Skip to the beginning of the next line.
+            offset += len(f.readline()) - 1
+            timestamp = None
+            transport = None
+            for line in f:
+                sipLine = line.strip()
+                if offset >= start and sipLine == SEPARATOR:
+                    for context in (timestamp, transport):
+                        if context:
+                            yield context
+                    yield line
+                    offset += len(line)
+                    break
+                offset += len(line)
+                # Same context parseSipMessages keeps, a message consumes its transport line.
+                if _TIMESTAMP.match(sipLine):
+                    timestamp = line
+                elif _TRANSPORT.match(sipLine):
+                    transport = line
+                elif ('sip:' in sipLine or sipLine.startswith('SIP/2.0')) and _MESSAGE.search(sipLine):
+                    transport = None
+        for line in f:
+            if end is not None and offset >= end and line.strip() == SEPARATOR:
+                break
+            offset += len(line)
+            yield line
+
+
+def parseShard(shard):
+    """
+    Map step of parallelSipCalls.
+    :param shard: (filename, start, end)
+    :return: Dictionary Call-ID -> SIP Messages, see sipCalls.
+    """
+    return sipCalls(parseSipMessages(readShard(*shard)))
+
+
+def parallelSipCalls(filenames, processes=None, shardSize=SHARD_SIZE):
+    """
+    Parse filenames in a pool of processes, shards of large files are parsed in parallel too.
+    Calls spanning shards or files are merged, SIP Messages keep the order of filenames.
+    :param filenames: Plain or gzip log files, oldest first.
+    :param processes: (int) Worker processes, defaults to number of CPUs.
+    :param shardSize: (int) Bytes per shard.
+    :return: Dictionary Call-ID -> SIP Messages, see sipCalls.
+    """
+    shards = [shard for filename in filenames for shard in shardFile(filename, shardSize)]
+    pool = multiprocessing.Pool(processes)
+    try:
+        allSipCalls = dict()
+        # imap keeps shard order, results are merged as they arrive.
+        for shardSipCalls in pool.imap(parseShard, shards):
+            for callId, callMessages in shardSipCalls.iteritems():
+                if callId in allSipCalls:
+                    allSipCalls[callId].extend(callMessages)
+                else:
+                    allSipCalls[callId] = callMessages
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+    return allSipCalls
 
 
 def sipCalls(sipMessages):
@@ -211,6 +452,206 @@ def sipCalls(sipMessages):
     return sipCalls
 
 
+def isCallEnd(sipMsg):
+    """
+    True for the final response to a BYE.
+    :param sipMsg:
+    :return:
+    """
+    if not sipMsg.sipMsgMethodInfo.startswith('SIP/2.0'):
+        return False
+    cseq = sipMsg.getHeader('cseq')
+    return bool(cseq) and cseq.endswith('BYE') and not sipMsg.sipMsgMethodInfo.startswith('SIP/2.0 1')
+
+
+class SipCallTracker(object):
+    """
+    Groups SIP messages by Call-ID. Calls complete when their BYE is answered or after maxIdle
+    without messages, measured in the same unit as the clock passed to add (seconds or messages).
+    """
+
+    def __init__(self, maxIdle):
+        self._maxIdle = maxIdle
+        # Call-ID -> [last seen, SIP Messages, ringing, temporary unavailable], from least to most recently seen.
+        self._openCalls = collections.OrderedDict()
+        self._completed = list()
+
+    def __len__(self):
+        return len(self._openCalls)
+
+    def add(self, sipMsg, now):
+        """
+        Add sipMsg to its call.
+        :param sipMsg:
+        :param now:
+        :return: True if the call matches callAnalyzer since sipMsg, without rescanning its messages.
+        """
+        callId = sipMsg.sipCallId
+        call = self._openCalls.pop(callId, None)
+        if call is None:
+            call = [now, list(), False, False]
+        call[0] = now
+        call[1].append(sipMsg)
+        matched = call[2] and call[3]
+        ringing, temporaryUnavailable = messageFlags(sipMsg)
+        call[2] = call[2] or ringing
+        call[3] = call[3] or temporaryUnavailable
+        if isCallEnd(sipMsg):
+            self._completed.append((callId, call[1]))
+        else:
+            self._openCalls[callId] = call
+        return call[2] and call[3] and not matched
+
+    def popCompleted(self, now):
+        """
+        :param now:
+        :return: (Call-ID, SIP Messages) of calls completed or idle since last call.
+        """
+        completed, self._completed = self._completed, list()
+        while self._openCalls:
+            callId, call = next(self._openCalls.iteritems())
+            if now - call[0] < self._maxIdle:
+                break
+            del self._openCalls[callId]
+            completed.append((callId, call[1]))
+        return completed
+
+    def popAll(self):
+        completed = self._completed + [(callId, call[1]) for callId, call in self._openCalls.iteritems()]
+        self._completed = list()
+        self._openCalls.clear()
+        return completed
+
+
+def streamSipCalls(sipMessages, maxIdle=MAX_IDLE_MESSAGES):
+    """
+    Group sipMessages by Call-ID incrementally. Yields (Call-ID, SIP Messages) once the BYE is answered
+    or no message of the call was seen in the last maxIdle messages, and the remaining calls at the end.
+    Only open calls are kept in memory.
+    :param sipMessages:
+    :param maxIdle:
+    :return: Generator of (Call-ID, list of sipMessage).
+    """
+    tracker = SipCallTracker(maxIdle)
+    for position, sipMsg in enumerate(sipMessages):
+        tracker.add(sipMsg, position)
+        for call in tracker.popCompleted(position):
+            yield call
+    for call in tracker.popAll():
+        yield call
+
+
+def followFile(filename, pollInterval=1.0, fromStart=False, stop=None):
+    """
+    Yield lines appended to filename, like tail -F. Reopens filename when it is rotated and
+    rereads it when truncated. Yields IDLE after each poll without new lines.
+    :param filename:
+    :param pollInterval: Seconds between checks for new lines.
+    :param fromStart: Read existing lines first instead of starting at the end.
+    :param stop: threading.Event, stops following when set.
+    :return:
+    """
+    f = None
+    partial = ''
+    while not (stop and stop.is_set()):
+        if f is None:
+            try:
+                f = io.open(filename, 'rb')
+            except IOError:
+                # Read from the start once created.
+                fromStart = True
+                yield IDLE
+                time.sleep(pollInterval)
+                continue
+            if not fromStart:
+                f.seek(0, os.SEEK_END)
+            # Files appearing after rotation are always read from the start.
+            fromStart = True
+        line = f.readline()
+        if line:
+            if line.endswith('\n'):
+                yield partial + line
+                partial = ''
+            else:
+                partial += line
+            continue
+        try:
+            st = os.stat(filename)
+        except OSError:
+            st = None
+        if st is None or st.st_ino != os.fstat(f.fileno()).st_ino:
+            # Rotated, old file is fully read.
+            f.close()
+            f = None
+            if partial:
+                yield partial
+                partial = ''
+            if st is not None:
+                continue
+        elif st.st_size < f.tell():
+            # Truncated.
+            f.seek(0)
+            partial = ''
+            continue
+        yield IDLE
+        time.sleep(pollInterval)
+    if f:
+        f.close()
+
+
+def followSipCalls(filename, idleTimeout=IDLE_TIMEOUT, pollInterval=1.0, fromStart=False, stop=None):
+    """
+    Follow filename and yield call level records as soon as they are known:
+        twilio_error: getTwilioError matched a SIP Message.
+        ringing_480: callAnalyzer matched a call.
+        call: A call completed, its BYE was answered or no message was seen for idleTimeout seconds.
+    :param filename:
+    :param idleTimeout:
+    :param pollInterval:
+    :param fromStart:
+    :param stop:
+    :return: Generator of dict.
+    """
+    tracker = SipCallTracker(idleTimeout)
+    for sipMsg in parseSipMessages(followFile(filename, pollInterval, fromStart, stop)):
+        now = time.time()
+        if sipMsg is not IDLE:
+            matched = tracker.add(sipMsg, now)
+            for errorType in ('01', '02'):
+                values = getTwilioError(sipMsg, errorType)
+                if values:
+                    yield {'event': 'twilio_error', 'callId': sipMsg.sipCallId, 'errorType': errorType,
+                           'values': values, 'time': now}
+            if matched:
+                yield {'event': 'ringing_480', 'callId': sipMsg.sipCallId, 'time': now}
+        for callId, callMessages in tracker.popCompleted(now):
+            yield callRecord(callId, callMessages, now)
+    for callId, callMessages in tracker.popAll():
+        yield callRecord(callId, callMessages, time.time())
+
+
+def callRecord(callId, sipMessages, now=None):
+    """
+    Call level summary of sipMessages.
+    :param callId:
+    :param sipMessages:
+    :param now:
+    :return: dict
+    """
+    uuid = None
+    uri = None
+    for sipMsg in sipMessages:
+        uuid = uuid or sipMsg.sipUuid
+        uri = uri or sipMsg.sipUri
+    return {'event': 'call',
+            'callId': callId,
+            'uuid': uuid,
+            'uri': uri,
+            'messages': [sipMsg.sipMsgMethodInfo for sipMsg in sipMessages],
+            'ringing480': callAnalyzer(sipMessages),
+            'time': now}
+
+
 def getSipCallUuid(sipMessages):
     """
 
@@ -269,15 +710,24 @@ def callAnalyzer(sipMessages):
 
     for sipMsg in sipMessages:
         if sipMsg:
-            if "Ringing" in sipMsg.sipMsgMethodInfo:
-                ringing = True
-            if "480 Temporarily Unavailable" in sipMsg.sipMsgMethodInfo or \
-                            "480 Temporarily not available" in sipMsg.sipMsgMethodInfo:
-                temporaryUnavailable = True
+            messageRinging, messageTemporaryUnavailable = messageFlags(sipMsg)
+            ringing = ringing or messageRinging
+            temporaryUnavailable = temporaryUnavailable or messageTemporaryUnavailable
 
     return ringing & temporaryUnavailable
 
 
+def messageFlags(sipMsg):
+    """
+    Conditions of callAnalyzer met by a single SIP Message.
+    :param sipMsg:
+    :return: (ringing, temporaryUnavailable)
+    """
+    info = sipMsg.sipMsgMethodInfo
+    return ("Ringing" in info,
+            "480 Temporarily Unavailable" in info or "480 Temporarily not available" in info)
+
+
 def printSipMessages(sipMessages, process=False):
     """
 
@@ -300,6 +750,8 @@ def printSipMessages(sipMessages, process=False):
             if process:
                 values = getTwilioError(sipMsg)
                 if values:
+                    callSid, callId, Reason = values
+                    print callSid, "|", callId, "|", Reason
                     print uri + '|' + uuid + '|' + str('|'.join(values))
                     uri = None
                     uuid = None
@@ -320,39 +772,43 @@ def getTwilioError(sipMessage, errorType='01'):
     if sipMessage:
         if errorType == '01':
             if "BYE" in sipMessage.sipMsgMethodInfo:
-                sipHeaders = sipMessage.sipHeaderInfo
-                for sipHeader in sipHeaders:
-                    if 'Twilio-CallSid:' in sipHeader:
-                        callSid = sipHeader[1]
-                    if 'Reason:' in sipHeader:
-                        Reason = sipHeader[1]
-                    if 'Call-ID:' in sipHeader:
-                        callId = sipHeader[1]
+                callSid = sipMessage.getHeader('twilio-callsid')
+                Reason = sipMessage.getHeader('reason')
+                callId = sipMessage.getHeader('call-id')
             if Reason and (callSid or callId):
                 if "MVTSLocal" in Reason:
-                    print callSid, "|", callId, "|", Reason
                     return callSid, callId, Reason
 
         if errorType == '02':
             if "Trunk CPS limit exceeded" in sipMessage.sipMsgMethodInfo:
-                sipHeaders = sipMessage.sipHeaderInfo
-                for sipHeader in sipHeaders:
-                    if 'Twilio-Error:' in sipHeader:
-                        twilioError = sipHeader[1]
-                    if 'Call-ID:' in sipHeader:
-                        callId = sipHeader[1]
+                twilioError = sipMessage.getHeader('twilio-error')
+                callId = sipMessage.getHeader('call-id')
 
             if twilioError and callId:
                 return twilioError, callId
 
 
-if __name__ == "__main__":
-    if len(sys.argv) == 2:
-        filename = sys.argv[1]
-    else:
+def main(argv):
+    filenames = argv[1:]
+    if not filenames or (FLAGS.follow and len(filenames) > 1):
         raise ValueError('Invalid file')
-    if filename:
-        allSipMessages = readFile(filename)
-        printSipMessages(allSipMessages)
-        allSipCalls = sipCalls(allSipMessages)
-        analyzeSipCalls(allSipCalls, None)
+    if FLAGS.follow:
+        for record in followSipCalls(filenames[0], FLAGS.idle_timeout, FLAGS.poll_interval, FLAGS.from_start):
+            print json.dumps(record)
+            sys.stdout.flush()
+    elif len(filenames) > 1 or FLAGS.processes != 1:
+        allSipCalls = parallelSipCalls(filenames, FLAGS.processes or None, FLAGS.shard_size * 1024 * 1024)
+        for callId, callMessages in allSipCalls.iteritems():
+            printSipMessages(callMessages)
+            if callAnalyzer(callMessages):
+                print callId
+    else:
+        # Single pass over the file, calls are analyzed as soon as they complete.
+        for callId, callMessages in streamSipCalls(readFile(filenames[0])):
+            printSipMessages(callMessages)
+            if callAnalyzer(callMessages):
+                print callId
+
+
+if __name__ == "__main__":
+    app.run(main)
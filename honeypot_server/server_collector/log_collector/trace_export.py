@@ -0,0 +1,308 @@
+"""Export parsed SIP traces to columnar files partitioned by day.
+
+Writes two tables, one row per SIP message and one row per call, under
+output_dir/<table>/day=YYYY-MM-DD/part-NNNNN.npz (NumPy) or .parquet (needs
+pyarrow). Method and User-Agent columns are dictionary encoded: NumPy parts
+store '<column>.codes' and '<column>.dictionary' arrays. Status codes are
+int16 columns, 0 for requests.
+
+An export replaces the partitions of the days it writes, so exporting a log
+again does not duplicate rows, but all files of a day must be exported
+together. Parts are written to a hidden staging directory that is renamed
+over the partition when the export completes.
+
+Usage:
+    python trace_export.py --output_dir=/data/sip freeswitch.log freeswitch.log.1.gz
+"""
+
+import glob
+import os
+import shutil
+
+import numpy as np
+from absl import app
+from absl import flags
+from absl import logging
+
+import trace_analyzer
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+FLAGS = flags.FLAGS
+
+NPZ = 'npz'
+PARQUET = 'parquet'
+MESSAGES = 'messages'
+CALLS = 'calls'
+UNKNOWN_DAY = 'unknown'
+
+flags.DEFINE_string('output_dir', None, 'Directory of exported tables')
+flags.DEFINE_enum('format', NPZ, [NPZ, PARQUET], 'File format, parquet requires pyarrow')
+flags.DEFINE_integer('rows_per_file', 1000000, 'Maximum rows per part file')
+
+# Column kinds.
+STRING = 'string'
+DICTIONARY = 'dictionary'
+TIMESTAMP = 'timestamp'
+INT16 = 'int16'
+INT32 = 'int32'
+BOOL = 'bool'
+
+TABLES = {
+    MESSAGES: (('call_id', STRING),
+               ('timestamp', TIMESTAMP),
+               ('method', DICTIONARY),
+               ('status', INT16),
+               ('user_agent', DICTIONARY),
+               ('has_sdp', BOOL)),
+    CALLS: (('call_id', STRING),
+            ('start', TIMESTAMP),
+            ('end', TIMESTAMP),
+            ('messages', INT32),
+            ('method', DICTIONARY),
+            ('final_status', INT16),
+            ('ringing_480', BOOL),
+            ('uuid', STRING),
+            ('uri', STRING),
+            ('user_agent', DICTIONARY)),
+}
+
+
+def messageMethod(sipMsg):
+    """
+    :param sipMsg: trace_analyzer.sipMessage
+    :return: (method, status). Method of a response comes from its CSeq, status of a request is 0.
+    """
+    info = sipMsg.sipMsgMethodInfo
+    if info.startswith('SIP/2.0'):
+        parts = info.split(None, 2)
+        status = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 0
+        cseq = sipMsg.getHeader('cseq')
+        return (cseq.split()[-1] if cseq else ''), status
+    return info.split(None, 1)[0], 0
+
+
+def messageRow(sipMsg):
+    method, status = messageMethod(sipMsg)
+    return (sipMsg.sipCallId or '',
+            sipMsg.sipTimestamp,
+            method,
+            status,
+            sipMsg.getHeader('user-agent', ''),
+            sipMsg.hasSDP)
+
+
+def callRow(callId, sipMessages):
+    finalStatus = 0
+    userAgent = ''
+    uuid = ''
+    uri = ''
+    for sipMsg in sipMessages:
+        method, status = messageMethod(sipMsg)
+        if method == 'INVITE' and status >= 200:
+            finalStatus = status
+        userAgent = userAgent or sipMsg.getHeader('user-agent', '')
+        uuid = uuid or sipMsg.sipUuid or ''
+        uri = uri or sipMsg.sipUri or ''
+    return (callId or '',
+            sipMessages[0].sipTimestamp,
+            sipMessages[-1].sipTimestamp,
+            len(sipMessages),
+            messageMethod(sipMessages[0])[0],
+            finalStatus,
+            trace_analyzer.callAnalyzer(sipMessages),
+            uuid,
+            uri,
+            userAgent)
+
+
+def dictionaryEncode(values):
+    """
+    :param values: List of str.
+    :return: (codes, dictionary) numpy arrays, values == dictionary[codes].
+    """
+    index = dict()
+    codes = np.fromiter((index.setdefault(value, len(index)) for value in values), dtype=np.int32,
+                        count=len(values))
+    dictionary = [None] * len(index)
+    for value, code in index.iteritems():
+        dictionary[code] = value
+    return codes, np.array(dictionary, dtype=np.string_)
+
+
+def _column(kind, values):
+    if kind == TIMESTAMP:
+        return np.array([value or 'NaT' for value in values], dtype='datetime64[us]')
+    if kind == STRING:
+        return np.array(values, dtype=np.string_)
+    return np.array(values, dtype=kind)
+
+
+def writeNpz(path, columns, values):
+    arrays = dict()
+    for (name, kind), columnValues in zip(columns, values):
+        if kind == DICTIONARY:
+            arrays[name + '.codes'], arrays[name + '.dictionary'] = dictionaryEncode(columnValues)
+        else:
+            arrays[name] = _column(kind, columnValues)
+    np.savez(path, **arrays)
+
+
+def writeParquet(path, columns, values):
+    arrays = list()
+    for (name, kind), columnValues in zip(columns, values):
+        if kind == DICTIONARY:
+            codes, dictionary = dictionaryEncode(columnValues)
+            arrays.append(pa.DictionaryArray.from_arrays(pa.array(codes), pa.array(dictionary)))
+        else:
+            arrays.append(pa.array(_column(kind, columnValues)))
+    pq.write_table(pa.Table.from_arrays(arrays, [name for name, _ in columns]), path)
+
+
+class ColumnarWriter(object):
+    """Buffers rows per table and day, writes them as part files of up to rowsPerFile rows."""
+
+    def __init__(self, outputDir, fileFormat=NPZ, rowsPerFile=1000000):
+        """
+
+        :param outputDir: (str) Directory of exported tables.
+        :param fileFormat: (str) NPZ or PARQUET.
+        :param rowsPerFile: (int) Maximum rows per part file.
+        """
+        if fileFormat == PARQUET and pq is None:
+            raise ValueError('Parquet format requires pyarrow')
+        self._outputDir = outputDir
+        self._format = fileFormat
+        self._rowsPerFile = rowsPerFile
+        # (table, day) -> list of rows.
+        self._rows = dict()
+        # (table, day) partitions written by this export.
+        self._staged = set()
+        self.files = list()
+
+    def addMessage(self, sipMsg):
+        self._add(MESSAGES, sipMsg.sipTimestamp, messageRow(sipMsg))
+
+    def addCall(self, callId, sipMessages):
+        self._add(CALLS, sipMessages[0].sipTimestamp, callRow(callId, sipMessages))
+
+    def _add(self, table, timestamp, row):
+        key = (table, timestamp[:10] if timestamp else UNKNOWN_DAY)
+        rows = self._rows.setdefault(key, list())
+        rows.append(row)
+        if len(rows) >= self._rowsPerFile:
+            self._flush(key)
+
+    def _partition(self, table, day, staging=False):
+        return os.path.join(self._outputDir, table, ('.day=%s.staging' if staging else 'day=%s') % day)
+
+    def _flush(self, key):
+        rows = self._rows.pop(key, None)
+        if not rows:
+            return
+        table, day = key
+        directory = self._partition(table, day, staging=True)
+        if key not in self._staged:
+            # Left over by an interrupted export.
+            if os.path.isdir(directory):
+                shutil.rmtree(directory)
+            os.makedirs(directory)
+            self._staged.add(key)
+        name = 'part-%05d.%s' % (len(glob.glob(os.path.join(directory, 'part-*'))), self._format)
+        path = os.path.join(directory, name)
+        columns = TABLES[table]
+        values = zip(*rows)
+        if self._format == PARQUET:
+            writeParquet(path, columns, values)
+        else:
+            writeNpz(path, columns, values)
+        # Where the part is once close replaces the partition.
+        self.files.append(os.path.join(self._partition(table, day), name))
+        logging.info('Wrote %d %s to %s' % (len(rows), table, path))
+
+    def close(self):
+        """Flush pending rows and replace the written partitions."""
+        for key in self._rows.keys():
+            self._flush(key)
+        for table, day in sorted(self._staged):
+            staging = self._partition(table, day, staging=True)
+            directory = self._partition(table, day)
+            previous = self._partition(table, day, staging=True) + '.previous'
+            if os.path.isdir(previous):
+                shutil.rmtree(previous)
+            if os.path.isdir(directory):
+                os.rename(directory, previous)
+            os.rename(staging, directory)
+            if os.path.isdir(previous):
+                shutil.rmtree(previous)
+        self._staged.clear()
+
+
+def export(filenames, outputDir, fileFormat=NPZ, rowsPerFile=1000000):
+    """
+    Parse filenames and export their messages and calls.
+    :param filenames: Plain or gzip log files, oldest first.
+    :param outputDir:
+    :param fileFormat:
+    :param rowsPerFile:
+    :return: List of files written.
+    """
+    writer = ColumnarWriter(outputDir, fileFormat, rowsPerFile)
+
+    def sipMessages():
+        for filename in filenames:
+            for sipMsg in trace_analyzer.readFile(filename):
+                writer.addMessage(sipMsg)
+                yield sipMsg
+
+    for callId, callMessages in trace_analyzer.streamSipCalls(sipMessages()):
+        writer.addCall(callId, callMessages)
+    writer.close()
+    return writer.files
+
+
+def readColumns(path):
+    """
+    Read a NumPy part file.
+    :param path:
+    :return: Dictionary column -> numpy array, dictionary encoded columns decoded.
+    """
+    columns = dict()
+    with np.load(path) as npz:
+        for name in npz.files:
+            if name.endswith('.codes'):
+                column = name[:-len('.codes')]
+                columns[column] = npz[column + '.dictionary'][npz[name]]
+            elif not name.endswith('.dictionary'):
+                columns[name] = npz[name]
+    return columns
+
+
+def readDay(outputDir, day, table=CALLS):
+    """
+    Read all NumPy part files of a table for a day.
+    :param outputDir:
+    :param day: (str) 'YYYY-MM-DD'.
+    :param table: MESSAGES or CALLS.
+    :return: Dictionary column -> numpy array.
+    """
+    paths = sorted(glob.glob(os.path.join(outputDir, table, 'day=%s' % day, 'part-*.%s' % NPZ)))
+    parts = [readColumns(path) for path in paths]
+    if not parts:
+        return dict()
+    return {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+
+
+def main(argv):
+    if len(argv) < 2 or not FLAGS.output_dir:
+        raise ValueError('Invalid file or output directory')
+    export(argv[1:], FLAGS.output_dir, FLAGS.format, FLAGS.rows_per_file)
+
+
+if __name__ == "__main__":
+    app.run(main)
@@ -0,0 +1,207 @@
+"""Memory mapped SIP message scanner for large freeswitch.log traces.
+
+Finds messages framed by SEPARATOR lines with bytes level searches over the
+mapped file. Like trace_analyzer.parseSipMessages, a frame holding several
+messages is split at their start lines. Messages are MappedSipMessage objects
+holding offsets into the map; method, status code and headers are only read
+when accessed, and a full trace_analyzer.sipMessage is built only for
+messages passing the filters.
+
+Usage:
+    python trace_scanner.py --method=INVITE --header=User-Agent freeswitch.log
+    python trace_scanner.py --status=480 --status=503 freeswitch.log
+"""
+
+import mmap
+import os
+import re
+
+from absl import app
+from absl import flags
+
+import trace_analyzer
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_multi_string('method', [], 'Only requests with this method, e.g. INVITE')
+flags.DEFINE_multi_integer('status', [], 'Only responses with this status code, e.g. 480')
+flags.DEFINE_multi_string('header', [], 'Only messages with this header, e.g. Twilio-Error')
+
+# First line of a message, request (method) or response (status code).
+_START_LINE = re.compile(r'[ \t]*(?:(\w+)[ \t]+sip:|SIP/2\.0[ \t]+(\d{3}))')
+# New line followed by a start line, a message without SEPARATOR before it.
+_NEXT_START_LINE = re.compile(r'\n[ \t]*(?:\w+[ \t]+sip:|SIP/2\.0[ \t]+\d{3})')
+_HEADER_NAME = re.compile(r'[ \t]*([A-Za-z][\w-]*):[ \t]?')
+_BLANK_LINE = re.compile(r'[ \t\r]*$')
+
+
+class MappedSipMessage(object):
+    """SIP message stored as offsets into a mapped trace. Valid while the map is open."""
+
+    __slots__ = ('_buffer', 'start', 'end', '_firstLineEnd', '_method', '_statusCode', '_headers')
+
+    def __init__(self, buffer, start, end, firstLineEnd, method, statusCode):
+        """
+
+        :param buffer: mmap of the trace.
+        :param start: (int) Offset of the first line.
+        :param end: (int) Offset after the last line.
+        :param firstLineEnd: (int) Offset of the first line new line.
+        :param method: (str) Request method or None.
+        :param statusCode: (int) Response status code or None.
+        """
+        self._buffer = buffer
+        self.start = start
+        self.end = end
+        self._firstLineEnd = firstLineEnd
+        self._method = method
+        self._statusCode = statusCode
+        self._headers = None
+
+    @property
+    def method(self):
+        return self._method
+
+    @property
+    def statusCode(self):
+        return self._statusCode
+
+    @property
+    def firstLine(self):
+        return self._buffer[self.start:self._firstLineEnd].strip()
+
+    def headerOffsets(self):
+        """
+        Index of header lines, built on first use.
+        :return: List of (nameStart, nameEnd, valueStart, valueEnd).
+        """
+        if self._headers is None:
+            self._headers = list()
+            buffer = self._buffer
+            lineStart = self._firstLineEnd + 1
+            while lineStart < self.end:
+                lineEnd = buffer.find('\n', lineStart, self.end)
+                if lineEnd == -1:
+                    lineEnd = self.end
+                # Headers end at the blank line before the body.
+                if _BLANK_LINE.match(buffer, lineStart, lineEnd):
+                    break
+                header = _HEADER_NAME.match(buffer, lineStart, lineEnd)
+                if header:
+                    valueEnd = lineEnd
+                    if buffer[valueEnd - 1:valueEnd] == '\r':
+                        valueEnd -= 1
+                    self._headers.append((header.start(1), header.end(1), header.end(), valueEnd))
+                lineStart = lineEnd + 1
+        return self._headers
+
+    def _find(self, name):
+        name = name.lower()
+        for nameStart, nameEnd, valueStart, valueEnd in self.headerOffsets():
+            if nameEnd - nameStart == len(name) and self._buffer[nameStart:nameEnd].lower() == name:
+                yield valueStart, valueEnd
+
+    def hasHeader(self, name):
+        for _ in self._find(name):
+            return True
+        return False
+
+    def header(self, name):
+        """
+        :param name: (str) Header name, case insensitive, without ':'.
+        :return: First value of header or None.
+        """
+        for valueStart, valueEnd in self._find(name):
+            return self._buffer[valueStart:valueEnd].strip()
+        return None
+
+    def toSipMessage(self):
+        """Parse message into a trace_analyzer.sipMessage."""
+        lines = self._buffer[self.start:self.end].splitlines()
+        for sipMsg in trace_analyzer.parseSipMessages(lines):
+            return sipMsg
+
+
+def scanBuffer(buffer, methods=None, statusCodes=None, headers=None):
+    """
+    Yield messages of buffer passing the filters.
+    :param buffer: mmap or str with freeswitch.log content.
+    :param methods: Request methods to keep.
+    :param statusCodes: Response status codes to keep. With methods, messages matching either are kept.
+    :param headers: Header names all kept messages have.
+    :return: Generator of MappedSipMessage.
+    """
+    methods = frozenset(methods or ())
+    statusCodes = frozenset(statusCodes or ())
+    headers = list(headers or ())
+    size = len(buffer)
+    position = buffer.find(trace_analyzer.SEPARATOR)
+    while position != -1:
+        start = buffer.find('\n', position, size) + 1
+        if not start:
+            break
+        position = buffer.find(trace_analyzer.SEPARATOR, start)
+        frameEnd = size if position == -1 else buffer.rfind('\n', start, position) + 1
+        while start < frameEnd:
+            firstLineEnd = buffer.find('\n', start, frameEnd)
+            if firstLineEnd == -1:
+                firstLineEnd = frameEnd
+            nextStart = _NEXT_START_LINE.search(buffer, firstLineEnd, frameEnd)
+            end = nextStart.start() + 1 if nextStart else frameEnd
+            message = _filteredMessage(buffer, start, end, firstLineEnd, methods, statusCodes, headers)
+            if message:
+                yield message
+            start = end
+
+
+def _filteredMessage(buffer, start, end, firstLineEnd, methods, statusCodes, headers):
+    """Returns MappedSipMessage for buffer[start:end] if it passes the filters, see scanBuffer."""
+    # Log lines between the end of a message and the next one do not match.
+    startLine = _START_LINE.match(buffer, start, firstLineEnd)
+    if not startLine:
+        return None
+    method = startLine.group(1)
+    statusCode = int(startLine.group(2)) if startLine.group(2) else None
+    if (methods or statusCodes) and method not in methods and statusCode not in statusCodes:
+        return None
+    message = MappedSipMessage(buffer, start, end, firstLineEnd, method, statusCode)
+    if all(message.hasHeader(header) for header in headers):
+        return message
+    return None
+
+
+def scanFile(filename, methods=None, statusCodes=None, headers=None):
+    """
+    Map filename and yield messages passing the filters, see scanBuffer. The map is closed
+    once the generator is exhausted, call toSipMessage while iterating to keep a message.
+    :param filename: Plain log file.
+    :param methods:
+    :param statusCodes:
+    :param headers:
+    :return: Generator of MappedSipMessage.
+    """
+    with open(filename, 'rb') as f:
+        if not os.fstat(f.fileno()).st_size:
+            return
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for message in scanBuffer(buffer, methods, statusCodes, headers):
+                yield message
+        finally:
+            buffer.close()
+
+
+def main(argv):
+    if len(argv) < 2:
+        raise ValueError('Invalid file')
+    for filename in argv[1:]:
+        sipMessages = (message.toSipMessage()
+                       for message in scanFile(filename, FLAGS.method, FLAGS.status, FLAGS.header))
+        for callId, callMessages in trace_analyzer.streamSipCalls(sipMessages):
+            trace_analyzer.printSipMessages(callMessages)
+            if trace_analyzer.callAnalyzer(callMessages):
+                print callId
+
+
+if __name__ == "__main__":
+    app.run(main)
@@ -0,0 +1,287 @@
+"""Asynchronous processing of Freeswitch CHANNEL_HANGUP events.
+
+The ESL read loop only parses event headers into a HangupRecord and submits
+it to a bounded WorkQueue. A pool of worker threads consumes the records and
+performs the slow steps (Homer lookup, threat prediction and notification).
+"""
+
+import collections
+import json
+import os
+import Queue
+import threading
+import time
+
+from absl import logging
+
+# Backpressure policies applied when the work queue is full.
+BLOCK = 'block'
+DROP_OLDEST = 'drop_oldest'
+SPILL = 'spill'
+POLICIES = (BLOCK, DROP_OLDEST, SPILL)
+
+# Pipeline stages tracked by LatencyCounters.
+STAGE_ENQUEUE = 'enqueue'
+STAGE_QUEUE_WAIT = 'queue_wait'
+STAGE_LOOKUP = 'lookup'
+STAGE_PREDICT = 'predict'
+STAGE_PUBLISH = 'publish'
+
+_GET_TIMEOUT = 0.5
+
+HangupRecord = collections.namedtuple('HangupRecord', ['uuid',
+                                                       'sip_call_id',
+                                                       'sip_remote_ip_addr',
+                                                       'sip_remote_port',
+                                                       'sip_protocol',
+                                                       'sip_from',
+                                                       'sip_from_stripped',
+                                                       'sip_to_user',
+                                                       'sip_req_uri',
+                                                       'event_timestamp',
+                                                       'received',
+                                                       'attempts'])
+
+
+class LatencyCounters(object):
+    """Thread safe count/total/max latency counters per pipeline stage."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, stage, elapsed):
+        """Records elapsed seconds for stage.
+
+        :param stage: (str) Stage name.
+        :param elapsed: (float) Elapsed time in seconds.
+        """
+        with self._lock:
+            stats = self._stats.setdefault(stage, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += elapsed
+            stats[2] = max(stats[2], elapsed)
+
+    def timer(self, stage):
+        """Returns a context manager which records the time spent in its block."""
+        return _StageTimer(self, stage)
+
+    def snapshot(self):
+        """Returns a dict of stage -> {'count', 'avg_ms', 'max_ms'}."""
+        with self._lock:
+            return {stage: {'count': count,
+                            'avg_ms': (total / count) * 1000.0 if count else 0.0,
+                            'max_ms': maximum * 1000.0}
+                    for stage, (count, total, maximum) in self._stats.iteritems()}
+
+    def report(self):
+        """Logs current counters."""
+        for stage, stats in sorted(self.snapshot().iteritems()):
+            logging.info('Stage: %s count: %d avg: %.2f ms max: %.2f ms' % (stage,
+                                                                             stats['count'],
+                                                                             stats['avg_ms'],
+                                                                             stats['max_ms']))
+
+
+class _StageTimer(object):
+    def __init__(self, counters, stage):
+        self._counters = counters
+        self._stage = stage
+        self._start = None
+
+    def __enter__(self):
+        self._start = time.time()
+        return self
+
+    def __exit__(self, exception_type, exception_val, trace):
+        self._counters.record(self._stage, time.time() - self._start)
+
+
+class SpillFile(object):
+    """FIFO of HangupRecords stored as JSON lines on disk.
+
+    Records left over by a previous run are picked up again on start.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._lock = threading.Lock()
+        self._read_offset = 0
+        self.pending = 0
+        if os.path.exists(path):
+            with open(path) as spill:
+                self.pending = sum(1 for _ in spill)
+            if self.pending:
+                logging.warning('Recovered %d spilled calls from %s' % (self.pending, path))
+
+    def write(self, record):
+        with self._lock:
+            with open(self._path, 'a') as spill:
+                spill.write(json.dumps(record._asdict()) + '\n')
+            self.pending += 1
+
+    def read(self):
+        """Returns the oldest spilled record or None."""
+        with self._lock:
+            if not self.pending:
+                return None
+            with open(self._path) as spill:
+                spill.seek(self._read_offset)
+                line = spill.readline()
+                self._read_offset = spill.tell()
+            self.pending -= 1
+            if not self.pending:
+                # Everything was consumed, start over with an empty file.
+                open(self._path, 'w').close()
+                self._read_offset = 0
+        return HangupRecord(**json.loads(line))
+
+
+class WorkQueue(object):
+    """Bounded queue of HangupRecords with a configurable backpressure policy.
+
+    block: put() waits until a worker frees a slot.
+    drop_oldest: put() discards the oldest queued record.
+    spill: put() appends to a SpillFile, drained once the queue is empty.
+    """
+
+    def __init__(self, maxsize, policy=BLOCK, spill_file=None):
+        if policy not in POLICIES:
+            raise ValueError('Invalid backpressure policy: %s' % policy)
+        if policy == SPILL and not spill_file:
+            raise ValueError('Spill policy requires a spill file')
+        self._queue = Queue.Queue(maxsize)
+        self._policy = policy
+        self._spill = SpillFile(spill_file) if policy == SPILL else None
+        self.dropped = 0
+
+    @property
+    def policy(self):
+        return self._policy
+
+    def qsize(self):
+        """Returns approximate number of records waiting, including spilled ones."""
+        return self._queue.qsize() + (self._spill.pending if self._spill else 0)
+
+    def put(self, record):
+        if self._policy == BLOCK:
+            self._queue.put(record)
+        elif self._policy == DROP_OLDEST:
+            while True:
+                try:
+                    self._queue.put_nowait(record)
+                    return
+                except Queue.Full:
+                    try:
+                        self._queue.get_nowait()
+                        self.dropped += 1
+                    except Queue.Empty:
+                        pass
+        else:
+            # Keep FIFO order: once spilling started, new records go to disk too.
+            if self._spill.pending:
+                self._spill.write(record)
+                return
+            try:
+                self._queue.put_nowait(record)
+            except Queue.Full:
+                self._spill.write(record)
+
+    def get(self, timeout=_GET_TIMEOUT):
+        """Returns next record or None if nothing arrived within timeout."""
+        try:
+            return self._queue.get_nowait()
+        except Queue.Empty:
+            pass
+        if self._spill:
+            record = self._spill.read()
+            if record:
+                return record
+        try:
+            return self._queue.get(timeout=timeout)
+        except Queue.Empty:
+            return None
+
+    def get_batch(self, max_size, window, timeout=_GET_TIMEOUT):
+        """Returns up to max_size records, waiting at most window seconds after the first one.
+
+        :param max_size: (int) Maximum number of records.
+        :param window: (float) Seconds to wait for more records once one arrived.
+        :param timeout: (float) Seconds to wait for the first record.
+        :return: (list) Records, empty if nothing arrived within timeout.
+        """
+        record = self.get(timeout)
+        if record is None:
+            return []
+        batch = [record]
+        deadline = time.time() + window
+        while len(batch) < max_size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            record = self.get(remaining)
+            if record is None:
+                break
+            batch.append(record)
+        return batch
+
+
+class PredictionPipeline(object):
+    """Pool of worker threads consuming batches of HangupRecords from a WorkQueue."""
+
+    def __init__(self, handler, work_queue, workers, counters=None, batch_size=1, flush_window=0):
+        """
+
+        :param handler: Callable invoked by workers with a list of HangupRecords.
+        :param work_queue: A WorkQueue.
+        :param workers: (int) Number of worker threads.
+        :param counters: A LatencyCounters.
+        :param batch_size: (int) Maximum records per handler call.
+        :param flush_window: (float) Seconds a worker waits to fill a batch.
+        """
+        if workers < 1:
+            raise ValueError('Invalid number of workers: %d' % workers)
+        self._handler = handler
+        self._queue = work_queue
+        self._workers = workers
+        self._batch_size = batch_size
+        self._flush_window = flush_window
+        self._threads = []
+        self._stop = threading.Event()
+        self.counters = counters or LatencyCounters()
+
+    @property
+    def queue(self):
+        return self._queue
+
+    def start(self):
+        for worker in range(self._workers):
+            thread = threading.Thread(target=self._run, name='prediction-worker-%d' % worker)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+        logging.info('Started %d prediction workers' % self._workers)
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def submit(self, record):
+        """Called from the ESL read loop. Enqueues a HangupRecord."""
+        with self.counters.timer(STAGE_ENQUEUE):
+            self._queue.put(record)
+
+    def _run(self):
+        while not self._stop.is_set():
+            records = self._queue.get_batch(self._batch_size, self._flush_window)
+            if not records:
+                continue
+            now = time.time()
+            for record in records:
+                self.counters.record(STAGE_QUEUE_WAIT, now - record.received)
+            try:
+                self._handler(records)
+            except Exception as e:
+                logging.exception(e)
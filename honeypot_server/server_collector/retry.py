@@ -0,0 +1,98 @@
+"""Delayed retries for calls not yet written to Homer.
+
+Homer captures the INVITE asynchronously, so the CHANNEL_HANGUP event may
+arrive before the row exists. Such calls are scheduled for another
+prediction attempt with exponential backoff.
+"""
+
+import heapq
+import itertools
+import random
+import threading
+import time
+
+from absl import logging
+
+_JITTER = 0.1
+
+
+def call_key(record):
+    """Returns dedupe key of a pipeline.HangupRecord."""
+    return record.sip_call_id, record.sip_remote_ip_addr, record.sip_remote_port
+
+
+class RetryScheduler(object):
+    """Time-ordered heap of HangupRecords keyed by next attempt time.
+
+    Records carry their attempt number, a record is given up once it reaches
+    max_attempts. A call already waiting for retry is not scheduled twice.
+    """
+
+    def __init__(self, max_attempts=5, initial_delay=2.0, max_delay=60.0, multiplier=2.0, max_pending=10000):
+        """
+
+        :param max_attempts: (int) Attempts, including the first one, before giving up.
+        :param initial_delay: (float) Seconds before the first retry.
+        :param max_delay: (float) Upper bound of seconds between retries.
+        :param multiplier: (float) Backoff multiplier.
+        :param max_pending: (int) Maximum number of calls waiting for retry.
+        """
+        self._max_attempts = max_attempts
+        self._initial_delay = initial_delay
+        self._max_delay = max_delay
+        self._multiplier = multiplier
+        self._max_pending = max_pending
+        self._heap = []
+        self._scheduled = set()
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self.deduped = 0
+        self.expired = 0
+        self.overflow = 0
+
+    def __len__(self):
+        return len(self._heap)
+
+    def delay(self, attempts):
+        """Returns seconds to wait after attempts failed attempts."""
+        delay = min(self._max_delay, self._initial_delay * self._multiplier ** (attempts - 1))
+        return delay * random.uniform(1 - _JITTER, 1 + _JITTER)
+
+    def schedule(self, record, now=None):
+        """Schedules another attempt for a record whose lookup failed.
+
+        :param record: A pipeline.HangupRecord.
+        :param now: (float) Current time.
+        :return: (bool) True if the record was scheduled.
+        """
+        attempts = record.attempts + 1
+        if attempts >= self._max_attempts:
+            logging.error('Giving up call with callid: %s after %d attempts' % (record.sip_call_id, attempts))
+            self.expired += 1
+            return False
+
+        key = call_key(record)
+        now = now or time.time()
+        with self._lock:
+            if key in self._scheduled:
+                self.deduped += 1
+                return False
+            if len(self._heap) >= self._max_pending:
+                logging.error('Retry queue is full. Dropping call with callid: %s' % record.sip_call_id)
+                self.overflow += 1
+                return False
+            self._scheduled.add(key)
+            heapq.heappush(self._heap, (now + self.delay(attempts), next(self._sequence),
+                                        record._replace(attempts=attempts)))
+        return True
+
+    def pop_due(self, now=None):
+        """Returns list of records whose next attempt time has passed."""
+        now = now or time.time()
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                _, _, record = heapq.heappop(self._heap)
+                self._scheduled.discard(call_key(record))
+                due.append(record)
+        return due
@@ -0,0 +1,100 @@
+"""Per source IP threat verdicts.
+
+Toll fraud sweeps send thousands of INVITEs from a handful of IPs. Once an IP
+is flagged as a threat, its following calls skip Homer lookup and scoring,
+and their notifications are coalesced into one per IP per window.
+"""
+
+import threading
+import time
+
+from utils import lru_cache
+
+
+class _Verdict(object):
+    __slots__ = ('window_start', 'count', 'record')
+
+    def __init__(self, window_start, record):
+        self.window_start = window_start
+        self.count = 0
+        self.record = record
+
+
+class VerdictCache(object):
+    """Threat verdicts per source IP with coalesced notifications."""
+
+    def __init__(self, ttl=3600, notify_window=60, max_entries=100000):
+        """
+
+        :param ttl: (float) Seconds an IP is considered a threat without a new verdict.
+        :param notify_window: (float) Minimum seconds between notifications for the same IP.
+        :param max_entries: (int) Maximum number of IPs remembered.
+        """
+        self._notify_window = notify_window
+        self._verdicts = lru_cache.LRUCache(max_entries=max_entries, max_bytes=max_entries * 1024, ttl=ttl,
+                                            sizeof=lambda key, value: 256)
+        self._lock = threading.Lock()
+        # IP -> _Verdict with calls not notified yet.
+        self._pending = {}
+        self.coalesced = 0
+
+    @property
+    def hits(self):
+        return self._verdicts.hits
+
+    def __len__(self):
+        return len(self._verdicts)
+
+    def add_threat(self, ip, record, now=None):
+        """Records a threat verdict for ip.
+
+        :param ip: (str) Source IP address.
+        :param record: A pipeline.HangupRecord.
+        :param now: (float) Current time.
+        :return: (bool) True if record should be notified now, False if it is aggregated.
+        """
+        now = now or time.time()
+        with self._lock:
+            verdict = self._verdicts.get(ip)
+            if verdict is lru_cache.MISSING:
+                self._verdicts.put(ip, _Verdict(now, record))
+                return True
+            self._aggregate(ip, verdict, record)
+            return False
+
+    def hit(self, ip, record):
+        """Fast path. Returns True if ip is a known threat and aggregates record."""
+        with self._lock:
+            verdict = self._verdicts.get(ip)
+            if verdict is lru_cache.MISSING:
+                return False
+            self._aggregate(ip, verdict, record)
+            return True
+
+    def _aggregate(self, ip, verdict, record):
+        verdict.count += 1
+        verdict.record = record
+        self._pending[ip] = verdict
+        self.coalesced += 1
+
+    def due_notifications(self, now=None):
+        """Returns (record, count) for IPs whose notify window elapsed with aggregated calls.
+
+        record is the most recent call from the IP, count the calls since last notification.
+        """
+        now = now or time.time()
+        due = []
+        with self._lock:
+            for ip, verdict in self._pending.items():
+                if now - verdict.window_start >= self._notify_window:
+                    due.append((verdict.record, verdict.count))
+                    verdict.count = 0
+                    verdict.window_start = now
+                    del self._pending[ip]
+        return due
+
+    def stats(self):
+        return {'ips': len(self._verdicts),
+                'hits': self._verdicts.hits,
+                'coalesced': self.coalesced,
+                'pending_notifications': len(self._pending)}
@@ -0,0 +1,107 @@
+"""Thread safe LRU cache with TTL and negative entries."""
+
+import collections
+import sys
+import threading
+import time
+
+# Returned by get() when key is not cached.
+MISSING = object()
+
+
+def _sizeof(key, value):
+    """Approximate bytes used by an entry. Counts tuple members one level deep."""
+    size = sys.getsizeof(key) + sys.getsizeof(value)
+    for item in (key, value):
+        if isinstance(item, tuple):
+            size += sum(sys.getsizeof(member) for member in item)
+    return size
+
+
+class LRUCache(object):
+    """Least recently used cache bounded by entry count and approximate bytes.
+
+    Entries expire after ttl seconds. Negative entries (a cached None, e.g.
+    a lookup which found nothing) use the shorter negative_ttl.
+    """
+
+    def __init__(self, max_entries=10000, max_bytes=32 * 1024 * 1024, ttl=300, negative_ttl=1, sizeof=_sizeof):
+        """
+
+        :param max_entries: (int) Maximum number of entries.
+        :param max_bytes: (int) Maximum approximate size of all entries.
+        :param ttl: (float) Seconds a value is valid.
+        :param negative_ttl: (float) Seconds a negative entry is valid.
+        :param sizeof: Callable returning bytes used by (key, value).
+        """
+        if max_entries < 1 or max_bytes < 1:
+            raise ValueError('Invalid cache size entries: %d bytes: %d' % (max_entries, max_bytes))
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._ttl = ttl
+        self._negative_ttl = negative_ttl
+        self._sizeof = sizeof
+        # key -> (value, expires, size), least recently used first.
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def bytes(self):
+        return self._bytes
+
+    def get(self, key):
+        """Returns cached value, None for negative entries or MISSING."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return MISSING
+            value, expires, size = entry
+            if expires < time.time():
+                self._bytes -= size
+                self.expirations += 1
+                self.misses += 1
+                return MISSING
+            # Re-insert as most recently used.
+            self._entries[key] = entry
+            if value is None:
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """Caches value. A None value is stored as a negative entry."""
+        ttl = self._negative_ttl if value is None else self._ttl
+        size = self._sizeof(key, value)
+        if size > self._max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous:
+                self._bytes -= previous[2]
+            self._entries[key] = (value, time.time() + ttl, size)
+            self._bytes += size
+            while len(self._entries) > self._max_entries or self._bytes > self._max_bytes:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def stats(self):
+        """Returns dict of counters."""
+        return {'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'negative_hits': self.negative_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations}
@@ -1,14 +1,30 @@
 """This is a MySQL client which allows connection to database."""
 
+import contextlib
+import Queue
+import threading
+import time
+
 from absl import logging
 
 import MySQLdb as mdb
 
 
+class MySQLPoolError(Exception):
+    """No connection became available in time."""
+
+
 class MySQLClient(object):
-    """This class allows you to connect to MySQL database."""
+    """This class allows you to connect to MySQL database.
+
+    Connections are kept in a thread safe pool of min_size to max_size
+    connections. Idle connections are health checked before reuse and a
+    query failing with a connection error is retried once on a new
+    connection, so a database failover is transparent to callers.
+    """
 
-    def __init__(self, username='root', password='', host='127.0.0.1', port=3306, database='default'):
+    def __init__(self, username='root', password='', host='127.0.0.1', port=3306, database='default',
+                 min_size=1, max_size=4, timeout=10, health_check_interval=30):
         """
 
         :param username:
@@ -16,20 +32,37 @@ class MySQLClient(object):
         :param host:
         :param port:
         :param database:
+        :param min_size: (int) Connections opened up front.
+        :param max_size: (int) Maximum number of open connections.
+        :param timeout: (float) Seconds to wait for a free connection.
+        :param health_check_interval: (float) Idle seconds after which a connection is pinged before use.
         :return:
         """
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError('Invalid pool size min: %d max: %d' % (min_size, max_size))
         self._username = username
         self._password = password
         self._host = host
         self._port = port
         self._database = database
-        self.cnx = self.connect()
+        self._max_size = max_size
+        self._timeout = timeout
+        self._health_check_interval = health_check_interval
+        # Idle connections as (connection, last used time), most recently used first.
+        self._idle = Queue.LifoQueue(max_size)
+        self._lock = threading.Lock()
+        self._size = 0
+        for _ in range(min_size):
+            self._idle.put((self._open(), time.time()))
 
     def disconnect(self, cnx):
         """
         :return:
         """
-        cnx.close()
+        try:
+            cnx.close()
+        except mdb.Error as e:
+            logging.warning('Error closing MySQL connection: %s' % e)
 
     def connect(self):
         """
@@ -37,19 +70,116 @@ class MySQLClient(object):
         :return:
         """
         cnx = mdb.connect(self._host, self._username, self._password, self._database, self._port)
+        cnx.autocommit(True)
         return cnx
 
-    def query(self, query):
+    def _open(self):
+        with self._lock:
+            if self._size >= self._max_size:
+                return None
+            self._size += 1
+        try:
+            return self.connect()
+        except mdb.Error:
+            with self._lock:
+                self._size -= 1
+            raise
+
+    def _discard(self, cnx):
+        self.disconnect(cnx)
+        with self._lock:
+            self._size -= 1
+
+    def _healthy(self, cnx, last_used):
+        if time.time() - last_used < self._health_check_interval:
+            return True
+        try:
+            cnx.ping()
+            return True
+        except mdb.Error:
+            logging.warning('Discarding stale MySQL connection')
+            return False
+
+    def _acquire(self):
+        deadline = time.time() + self._timeout
+        while True:
+            try:
+                cnx, last_used = self._idle.get_nowait()
+            except Queue.Empty:
+                cnx = self._open()
+                if cnx:
+                    return cnx
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise MySQLPoolError('No MySQL connection available after %d seconds' % self._timeout)
+                try:
+                    cnx, last_used = self._idle.get(timeout=remaining)
+                except Queue.Empty:
+                    continue
+            if self._healthy(cnx, last_used):
+                return cnx
+            self._discard(cnx)
+
+    def _release(self, cnx):
+        self._idle.put((cnx, time.time()))
+
+    @contextlib.contextmanager
+    def connection(self):
+        """Context manager lending a pooled connection.
+
+        Connections which raised a connection error are closed instead of returned.
         """
+        cnx = self._acquire()
+        try:
+            yield cnx
+        except mdb.OperationalError:
+            self._discard(cnx)
+            raise
+        except Exception:
+            self._release(cnx)
+            raise
+        self._release(cnx)
+
+    def _execute(self, query, params, fetch):
+        for attempt in range(2):
+            try:
+                with self.connection() as cnx:
+                    cursor = cnx.cursor()
+                    try:
+                        cursor.execute(query, params)
+                        if cursor.rowcount < 1:
+                            logging.error('No information')
+                        return fetch(cursor)
+                    finally:
+                        cursor.close()
+            except mdb.OperationalError as e:
+                if attempt:
+                    raise
+                logging.warning('MySQL connection error: %s. Reconnecting...' % e)
+
+    def query(self, query, params=None):
+        """Executes a parameterized query and returns first row.
 
-        :param cnx:
-        :param query:
+        :param query: (str) SQL statement with %s placeholders.
+        :param params: (tuple) Values escaped by the driver.
         :return:
         """
+        return self._execute(query, params, lambda cursor: cursor.fetchone())
 
-        cursor = self.cnx.cursor()
-        cursor.execute(query)
-        if cursor.rowcount < 1:
-            logging.error('No information')
-        return cursor.fetchone()
+    def query_many(self, query, params=None):
+        """Executes a parameterized query and returns all rows.
+
+        :param query: (str) SQL statement with %s placeholders.
+        :param params: (tuple) Values escaped by the driver.
+        :return:
+        """
+        return self._execute(query, params, lambda cursor: cursor.fetchall())
 
+    def close(self):
+        """Closes idle connections."""
+        while True:
+            try:
+                cnx, _ = self._idle.get_nowait()
+            except Queue.Empty:
+                break
+            self._discard(cnx)